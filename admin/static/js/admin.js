@@ -13,6 +13,9 @@ class RAGAdmin {
         
         this.fileQueue = [];
         this.processingTasks = new Map();
+        this.eventSource = null;
+        this.taskWatchers = new Map();  // taskId -> { fileId, statusItem }
+        this.taskEvents = new Map();    // taskId -> latest job event received
         
         this.init();
     }
@@ -177,9 +180,9 @@ class RAGAdmin {
             const result = await response.json();
             
             if (result.success) {
-                // Start polling for status
+                // Follow status updates pushed by the upload service
                 this.processingTasks.set(item.id, result.task_id);
-                await this.pollFileStatus(item.id, result.task_id, statusItem);
+                this.watchTask(item.id, result.task_id, statusItem);
             } else {
                 this.updateStatusItem(statusItem, 'Upload failed: ' + result.message, 0, 'error');
             }
@@ -217,20 +220,99 @@ class RAGAdmin {
         progressFill.className = `progress-fill ${status}`;
     }
     
+    // One shared event stream for all jobs, instead of polling per file
+    connectEvents() {
+        if (this.eventSource) return;
+        this.eventSource = new EventSource(`${this.uploadApiUrl}/events`);
+        this.eventSource.onmessage = (e) => {
+            const event = JSON.parse(e.data);
+            this.taskEvents.set(event.task_id, event);
+            this.applyTaskEvent(event);
+        };
+        // EventSource reconnects on its own after errors
+    }
+    
+    disconnectEvents() {
+        if (this.eventSource) {
+            this.eventSource.close();
+            this.eventSource = null;
+        }
+    }
+    
+    watchTask(fileId, taskId, statusItem) {
+        if (typeof EventSource === 'undefined') {
+            // Older browsers: fall back to polling
+            this.pollFileStatus(fileId, taskId, statusItem);
+            return;
+        }
+        
+        this.taskWatchers.set(taskId, { fileId, statusItem });
+        this.connectEvents();
+        
+        // The job may already have progressed before we started watching it
+        const latest = this.taskEvents.get(taskId);
+        if (latest) {
+            this.applyTaskEvent(latest);
+        }
+    }
+    
+    applyTaskEvent(event) {
+        const watcher = this.taskWatchers.get(event.task_id);
+        if (!watcher) return;
+        const { fileId, statusItem } = watcher;
+        
+        if (event.status === 'completed' || event.status === 'failed') {
+            const succeeded = event.status === 'completed';
+            this.updateStatusItem(statusItem, event.message, succeeded ? 100 : 0, succeeded ? 'success' : 'error');
+            this.taskWatchers.delete(event.task_id);
+            this.processingTasks.delete(fileId);
+            if (this.taskWatchers.size === 0) {
+                this.disconnectEvents();
+            }
+            return;
+        }
+        
+        this.updateStatusItem(statusItem, this.describeProgress(event), this.progressPercent(event));
+    }
+    
+    progressPercent(status) {
+        if (status.details && status.details.percent != null) {
+            return status.details.percent;
+        }
+        if (status.progress) {
+            const match = status.progress.match(/(\d+)%/);
+            if (match) {
+                return parseInt(match[1]);
+            }
+        }
+        return 0;
+    }
+    
+    describeProgress(status) {
+        let message = status.message;
+        if (status.progress) {
+            message += ` (${status.progress})`;
+        }
+        if (status.details && status.details.eta_s != null && status.status === 'processing') {
+            message += ` • ETA ${this.formatDuration(status.details.eta_s)}`;
+        }
+        return message;
+    }
+    
+    formatDuration(seconds) {
+        seconds = Math.round(seconds);
+        if (seconds < 60) return `${seconds}s`;
+        const minutes = Math.floor(seconds / 60);
+        return `${minutes}m ${seconds % 60}s`;
+    }
+    
     async pollFileStatus(fileId, taskId, statusItem) {
         try {
             const response = await fetch(`${this.uploadApiUrl}/status/${taskId}`);
             const status = await response.json();
             
-            if (status.status === 'processing') {
-                let percentage = 50;
-                if (status.progress) {
-                    const match = status.progress.match(/(\d+)%/);
-                    if (match) {
-                        percentage = parseInt(match[1]);
-                    }
-                }
-                this.updateStatusItem(statusItem, status.message, percentage);
+            if (['queued', 'processing', 'retrying'].includes(status.status)) {
+                this.updateStatusItem(statusItem, this.describeProgress(status), this.progressPercent(status));
                 
                 // Continue polling
                 setTimeout(() => this.pollFileStatus(fileId, taskId, statusItem), 2000);
@@ -1,35 +1,160 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
+import httpx
+import asyncio
+import json
 import os
+import re
 import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from typing import List
+from typing import List, Optional
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="RAG Answer API", version="1.0.0")
-
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 if not GROQ_API_KEY:
     raise ValueError("GROQ_API_KEY not found in environment variables")
 
+# Groq HTTP settings
+GROQ_TIMEOUT_S = float(os.getenv("GROQ_TIMEOUT_S", "60"))
+GROQ_CONNECT_TIMEOUT_S = float(os.getenv("GROQ_CONNECT_TIMEOUT_S", "5"))
+GROQ_RETRIES = int(os.getenv("GROQ_RETRIES", "2"))
+GROQ_RETRY_BACKOFF_S = float(os.getenv("GROQ_RETRY_BACKOFF_S", "0.5"))
+GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "50"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Failures where the request never reached Groq; anything later may have run the generation
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+GROQ_MODEL = "llama-3.1-8b-instant"
+
+# Context packing: chunks are added by relevance until the token budget is spent
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# Optional Hugging Face tokenizer matching GROQ_MODEL (a name or a local path).
+# Unset, or if it can't be loaded, tokens are estimated at ~4 characters each.
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "")
+# Word shingles used to detect text already in the context
+CONTEXT_SHINGLE_SIZE = int(os.getenv("CONTEXT_SHINGLE_SIZE", "8"))
+# Drop a chunk when at least this fraction of it is already in the context
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+# A chunk is cut to fit the remaining budget only if at least this many tokens remain
+CONTEXT_MIN_CHUNK_TOKENS = int(os.getenv("CONTEXT_MIN_CHUNK_TOKENS", "64"))
+
+groq_client = None
+tokenizer = None
+
+def load_tokenizer():
+    """Load the answer model's tokenizer, or None to use the character estimate"""
+    if not CONTEXT_TOKENIZER:
+        print("No CONTEXT_TOKENIZER set, estimating tokens from length")
+        return None
+    try:
+        from transformers import AutoTokenizer
+        loaded = AutoTokenizer.from_pretrained(CONTEXT_TOKENIZER)
+        print(f"Context tokenizer loaded: {CONTEXT_TOKENIZER}")
+        return loaded
+    except Exception as e:
+        print(f"Warning: could not load tokenizer {CONTEXT_TOKENIZER} ({e}), estimating tokens from length")
+        return None
+
+def count_tokens(text):
+    if tokenizer is None:
+        return (len(text) + 3) // 4
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+def truncate_tokens(text, max_tokens):
+    """Cut text to at most max_tokens tokens"""
+    if tokenizer is None:
+        limit = max_tokens * 4
+        if len(text) <= limit:
+            return text
+        # Cut back to the last whitespace so no word is split
+        head = text[:limit + 1]
+        cut = max(head.rfind(space) for space in " \t\n\r")
+        return text[:cut].rstrip() if cut > 0 else text[:limit]
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    return tokenizer.decode(ids[:max_tokens])
+
+def truncate_around(text, start, end, max_tokens):
+    """Cut text to at most max_tokens tokens, keeping the window around text[start:end]"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Window size in characters from the average token length of this text
+    width = len(text) * max_tokens // tokens
+    center = (start + end) // 2
+    lo = max(0, min(center - width // 2, len(text) - width, start))
+    if lo > 0:
+        # Start on a word boundary
+        lo = text.rfind(" ", 0, lo) + 1
+    return truncate_tokens(text[lo:], max_tokens)
+
+async def startup():
+    """Open the shared Groq client (also used by fused mode)"""
+    global groq_client, tokenizer
+    if tokenizer is None:
+        tokenizer = await asyncio.to_thread(load_tokenizer)
+    # Keep TLS connections to Groq alive across requests
+    groq_client = httpx.AsyncClient(
+        headers={
+            "Authorization": f"Bearer {GROQ_API_KEY}",
+            "Content-Type": "application/json",
+        },
+        limits=httpx.Limits(max_connections=GROQ_MAX_CONNECTIONS),
+        timeout=httpx.Timeout(GROQ_TIMEOUT_S, connect=GROQ_CONNECT_TIMEOUT_S)
+    )
+
+async def shutdown():
+    global groq_client
+    if groq_client is not None:
+        await groq_client.aclose()
+        groq_client = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+app = FastAPI(title="RAG Answer API", version="1.0.0", lifespan=lifespan)
+
+async def post_groq(data):
+    """POST a completion request, retrying rate limits, server errors and failed connects
+
+    Read timeouts are not retried: the completion may already have been generated.
+    """
+    for attempt in range(GROQ_RETRIES + 1):
+        try:
+            resp = await groq_client.post(GROQ_API_URL, json=data)
+            if resp.status_code not in RETRY_STATUS_CODES or attempt == GROQ_RETRIES:
+                return resp
+        except CONNECT_ERRORS:
+            if attempt == GROQ_RETRIES:
+                raise
+        await asyncio.sleep(GROQ_RETRY_BACKOFF_S * (2 ** attempt))
+
 class Chunk(BaseModel):
     chunk_id: int
     chunk_text: str
     source_name: str = None
+    # Character range of the best hit in a merged span (see app_retrieve.merge_run)
+    hit_start: Optional[int] = None
+    hit_end: Optional[int] = None
 
 class AnswerRequest(BaseModel):
     question: str
     chunks: List[Chunk]
+    stream: bool = False
 
 class AnswerResponse(BaseModel):
     answer: str
     sources: List[str]
     runtime_ms: int
+    prompt_tokens: Optional[int] = None
 
 @app.get("/")
 async def root():
@@ -39,20 +164,78 @@ async def root():
 async def health_check():
     return {"status": "healthy", "groq_api_configured": bool(GROQ_API_KEY)}
 
-@app.post("/answer", response_model=AnswerResponse)
-async def answer(req: AnswerRequest):
-    question = req.question.strip()
-    if not question:
-        raise HTTPException(status_code=400, detail="Empty question.")
+def word_shingles(text, size):
+    """Lowercased word n-grams of text, in order (one shorter gram for short texts)"""
+    words = text.lower().split()
+    return [tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))]
+
+def pack_context(chunks, budget=CONTEXT_TOKEN_BUDGET):
+    """Pick chunks in relevance order until the token budget is spent
+
+    Text already in the context is not sent twice: a chunk that mostly repeats
+    earlier ones is dropped, and a chunk overlapping them at its start or end
+    (the chunking overlap between neighbours) is trimmed to its new part. A
+    chunk that does not fit is cut to the rest of the budget, around its best
+    hit for merged spans.
+    Returns (packed chunks, context tokens used).
+    """
+    size = CONTEXT_SHINGLE_SIZE
+    seen = set()
+    packed = []
+    used = 0
     
-    if not req.chunks:
-        raise HTTPException(status_code=400, detail="No chunks provided.")
+    for chunk in chunks:
+        remaining = budget - used
+        if remaining < CONTEXT_MIN_CHUNK_TOKENS:
+            break
+        
+        # Keep word offsets so trimming preserves the original layout (tables)
+        spans = [m.span() for m in re.finditer(r"\S+", chunk.chunk_text)]
+        shingles = word_shingles(chunk.chunk_text, size)
+        novel = [shingle not in seen for shingle in shingles]
+        if not spans or sum(novel) <= (1 - CONTEXT_DUPLICATE_THRESHOLD) * len(novel):
+            continue
+        
+        # Trim an already-sent prefix and suffix
+        first = novel.index(True)
+        last = len(novel) - 1 - novel[::-1].index(True)
+        offset = spans[first][0]
+        text = chunk.chunk_text[offset:spans[min(last + size, len(spans)) - 1][1]]
+        
+        tokens = count_tokens(text)
+        if tokens > remaining:
+            hit_start = getattr(chunk, "hit_start", None)
+            hit_end = getattr(chunk, "hit_end", None)
+            if hit_start is not None and hit_end is not None:
+                # Merged span: keep the part around its best hit
+                text = truncate_around(text, max(hit_start - offset, 0),
+                                       min(max(hit_end - offset, 0), len(text)), remaining)
+            else:
+                # Fill the rest of the budget with the start of this chunk
+                text = truncate_tokens(text, remaining)
+            tokens = count_tokens(text)
+        
+        # Only what was actually sent counts as seen
+        seen.update(word_shingles(text, size))
+        packed.append(Chunk(chunk_id=chunk.chunk_id, chunk_text=text, source_name=chunk.source_name))
+        used += tokens
+    
+    return packed, used
+
+def build_completion_request(question, chunks):
+    """Build the Groq chat completion payload for the question and chunks
+
+    Chunks only need chunk_id, chunk_text and source_name attributes, so fused
+    mode can pass retrieval results straight through without re-validating
+    them. Returns (payload, packed chunks, prompt tokens).
+    """
+    chunks, _ = pack_context(chunks)
     
     # More precise table chunk detection
     table_chunks = []
     text_chunks = []
     
-    for chunk in req.chunks:
+    for chunk in chunks:
         chunk_text = chunk.chunk_text
         # Check for actual table content, not just any | character
         if ("TABLE DATA:" in chunk_text or 
@@ -63,9 +246,10 @@ async def answer(req: AnswerRequest):
             text_chunks.append(chunk)
     
     # Build context-aware prompt
+    parts = []
     if table_chunks and len(table_chunks) >= len(text_chunks):
         # Table-focused response
-        prompt = (
+        parts.append(
             "You are an expert data analyst. Analyze the provided tabular data carefully. "
             "When answering:\n"
             "1. Reference specific rows and columns\n"
@@ -76,79 +260,153 @@ async def answer(req: AnswerRequest):
         
         # Add table data first
         for i, chunk in enumerate(table_chunks):
-            chunk_text = chunk.chunk_text[:2000] + "..." if len(chunk.chunk_text) > 2000 else chunk.chunk_text
-            prompt += f"Table Data {i+1} (from {chunk.source_name}):\n{chunk_text}\n\n"
+            parts.append(f"Table Data {i+1} (from {chunk.source_name}):\n{chunk.chunk_text}\n\n")
         
         # Add supporting text context
         if text_chunks:
-            prompt += "Additional Context:\n"
-            for chunk in text_chunks[:3]:  # Limit text chunks when tables are primary
-                chunk_text = chunk.chunk_text[:500] + "..." if len(chunk.chunk_text) > 500 else chunk.chunk_text
-                prompt += f"{chunk_text}\n\n"
+            parts.append("Additional Context:\n")
+            for chunk in text_chunks:
+                parts.append(f"{chunk.chunk_text}\n\n")
     else:
         # Text-focused response
-        prompt = (
+        parts.append(
             "You are a helpful assistant. Use the provided context to answer the question accurately. "
             "If there are tables, reference them appropriately, but focus on the textual information.\n\n"
         )
         
         # Add text context first
         for chunk in text_chunks:
-            chunk_text = chunk.chunk_text[:1000] + "..." if len(chunk.chunk_text) > 1000 else chunk.chunk_text
-            prompt += f"Context from {chunk.source_name}:\n{chunk_text}\n\n"
+            parts.append(f"Context from {chunk.source_name}:\n{chunk.chunk_text}\n\n")
         
         # Add table context if available
         if table_chunks:
-            prompt += "Tabular Data:\n"
+            parts.append("Tabular Data:\n")
             for i, chunk in enumerate(table_chunks):
-                chunk_text = chunk.chunk_text[:1000] + "..." if len(chunk.chunk_text) > 1000 else chunk.chunk_text
-                prompt += f"Table {i+1}:\n{chunk_text}\n\n"
+                parts.append(f"Table {i+1}:\n{chunk.chunk_text}\n\n")
     
-    prompt += f"Question: {question}\n\nAnswer:"
+    parts.append(f"Question: {question}\n\nAnswer:")
+    prompt = "".join(parts)
     
     # Adjust parameters based on content type
     max_tokens = 800 if table_chunks else 500
     temperature = 0.2 if table_chunks else 0.4
     
-    headers = {
-        "Authorization": f"Bearer {GROQ_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    
     data = {
-        "model": "llama-3.1-8b-instant",
+        "model": GROQ_MODEL,
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": max_tokens,
         "temperature": temperature,
         "top_p": 0.9
     }
+    return data, chunks, count_tokens(prompt)
+
+def collect_sources(chunks):
+    """Collect unique source names"""
+    return sorted({chunk.source_name for chunk in chunks if chunk.source_name})
+
+def sse_event(payload):
+    """Format one Server-Sent Event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def generate_answer(question, chunks):
+    """Ask Groq for the full answer (core of /answer)"""
+    data, chunks, prompt_tokens = build_completion_request(question, chunks)
     
     try:
         t0 = time.time()
-        resp = requests.post(GROQ_API_URL, json=data, headers=headers, timeout=60)
+        resp = await post_groq(data)
         t1 = time.time()
         
         if resp.status_code != 200:
-            error_detail = resp.json() if resp.headers.get('content-type') == 'application/json' else resp.text
-            raise HTTPException(status_code=502, detail=f"Groq API error: {error_detail}")
+            error_detail = resp.json() if resp.headers.get('content-type', '').startswith('application/json') else resp.text
+            # Client errors (bad request, auth, rate limit) are passed through as-is
+            status_code = resp.status_code if 400 <= resp.status_code < 500 else 502
+            raise HTTPException(status_code=status_code, detail=f"Groq API error: {error_detail}")
         
         response_data = resp.json()
         generated = response_data["choices"][0]["message"]["content"].strip()
         
-        # Collect unique source names
-        sources = sorted({chunk.source_name for chunk in req.chunks if chunk.source_name})
+        # Prefer Groq's own count over the local one
+        usage = response_data.get("usage") or {}
         
         return AnswerResponse(
             answer=generated,
-            sources=sources,
-            runtime_ms=int((t1 - t0) * 1000)
+            sources=collect_sources(chunks),
+            runtime_ms=int((t1 - t0) * 1000),
+            prompt_tokens=usage.get("prompt_tokens", prompt_tokens)
         )
         
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Request to Groq failed: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Answer generation failed: {e}")
 
+async def stream_answer(question, chunks):
+    """Stream the answer from Groq as event dicts
+
+    Yields {"type": "token", "content": ...} for each generated piece, then a
+    single {"type": "done", ...} with sources, timings and prompt tokens, or
+    {"type": "error"}.
+    """
+    data, chunks, prompt_tokens = build_completion_request(question, chunks)
+    data["stream"] = True
+    
+    t0 = time.time()
+    first_token_ms = None
+    try:
+        async with groq_client.stream("POST", GROQ_API_URL, json=data) as resp:
+            if resp.status_code != 200:
+                error_detail = (await resp.aread()).decode("utf-8", errors="replace")
+                yield {"type": "error", "detail": f"Groq API error: {error_detail}"}
+                return
+            
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                
+                delta = json.loads(payload)["choices"][0].get("delta", {})
+                content = delta.get("content")
+                if content:
+                    if first_token_ms is None:
+                        first_token_ms = int((time.time() - t0) * 1000)
+                    yield {"type": "token", "content": content}
+        
+        yield {
+            "type": "done",
+            "sources": collect_sources(chunks),
+            "runtime_ms": int((time.time() - t0) * 1000),
+            "first_token_ms": first_token_ms,
+            "prompt_tokens": prompt_tokens
+        }
+        
+    except httpx.HTTPError as e:
+        yield {"type": "error", "detail": f"Request to Groq failed: {e}"}
+    except Exception as e:
+        yield {"type": "error", "detail": f"Answer generation failed: {e}"}
+
+@app.post("/answer", response_model=AnswerResponse)
+async def answer(req: AnswerRequest):
+    question = req.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Empty question.")
+    
+    if not req.chunks:
+        raise HTTPException(status_code=400, detail="No chunks provided.")
+    
+    if req.stream:
+        async def events():
+            async for event in stream_answer(question, req.chunks):
+                yield sse_event(event)
+        
+        return StreamingResponse(events(), media_type="text/event-stream")
+    
+    return await generate_answer(question, req.chunks)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
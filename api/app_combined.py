@@ -1,10 +1,68 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
+import httpx
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import numpy as np
+from contextlib import asynccontextmanager
+from pathlib import Path
 from typing import List, Optional
 
-app = FastAPI(title="RAG Combined API", version="1.0.0")
+# "http" calls the retrieve/answer services over HTTP,
+# "fused" runs their logic in this process (single-node installs)
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "http").lower()
+
+if PIPELINE_MODE == "fused":
+    # The service modules live next to this file
+    sys.path.insert(0, str(Path(__file__).parent))
+    import app_retrieve
+    import app_answer
+
+# Inter-service HTTP settings
+RETRIEVE_TIMEOUT_S = float(os.getenv("RETRIEVE_TIMEOUT_S", "30"))
+ANSWER_TIMEOUT_S = float(os.getenv("ANSWER_TIMEOUT_S", "60"))
+EMBED_TIMEOUT_S = float(os.getenv("EMBED_TIMEOUT_S", "10"))
+HTTP_CONNECT_TIMEOUT_S = float(os.getenv("HTTP_CONNECT_TIMEOUT_S", "5"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF_S = float(os.getenv("HTTP_RETRY_BACKOFF_S", "0.2"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+# Only for idempotent hops (retrieve, embed); /answer is retried on connect errors only
+RETRY_STATUS_CODES = {502, 503, 504}
+# Failures where the request never reached the upstream service
+CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+http_client = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_client
+    # One pooled keep-alive client shared by every request on this worker
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE
+        ),
+        timeout=httpx.Timeout(RETRIEVE_TIMEOUT_S, connect=HTTP_CONNECT_TIMEOUT_S)
+    )
+    if PIPELINE_MODE == "fused":
+        await app_retrieve.startup()
+        await app_answer.startup()
+        print("Running in fused pipeline mode")
+    yield
+    if PIPELINE_MODE == "fused":
+        await app_answer.shutdown()
+        await app_retrieve.shutdown()
+    await http_client.aclose()
+    http_client = None
+
+app = FastAPI(title="RAG Combined API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -18,10 +76,18 @@ app.add_middleware(
 # API endpoints
 RETRIEVE_URL = "http://localhost:8000/retrieve"
 ANSWER_URL = "http://localhost:8001/answer"
+EMBED_URL = "http://localhost:8000/embed"
+
+# Semantic answer cache settings
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "3600"))
 
 class QueryRequest(BaseModel):
     question: str
     num_chunks: int = 10
+    stream: bool = False
 
 class Chunk(BaseModel):
     chunk_id: int
@@ -33,30 +99,285 @@ class QueryResponse(BaseModel):
     answer: str
     sources: List[str]
     runtime_ms: int
+    cached: bool = False
+    prompt_tokens: Optional[int] = None
+
+class SemanticAnswerCache:
+    """Answers keyed by question embedding, matched by cosine similarity"""
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_s=ANSWER_CACHE_TTL_S):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl_s
+        self.vectors = None  # (n, dim) matrix of unit vectors
+        self.entries = []    # (num_chunks, response, expires_at) per row
+        self.hits = 0
+        self.misses = 0
+        # Bumped by clear(); answers computed against an older generation are not stored
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding, num_chunks):
+        query = self._unit(embedding)
+        with self.lock:
+            self._expire()
+            if self.vectors is not None and len(self.entries):
+                scores = self.vectors @ query
+                for idx in np.argsort(-scores):
+                    if scores[idx] < self.threshold:
+                        break
+                    if self.entries[idx][0] == num_chunks:
+                        self.hits += 1
+                        return self.entries[idx][1]
+            self.misses += 1
+            return None
+
+    def store(self, embedding, num_chunks, response, generation):
+        """Cache an answer, unless the cache was cleared since generation was read"""
+        row = self._unit(embedding)[None, :]
+        with self.lock:
+            if generation != self.generation:
+                return
+            self._expire()
+            if len(self.entries) >= self.max_entries:
+                # Drop the oldest entry
+                self.vectors = self.vectors[1:]
+                self.entries = self.entries[1:]
+            self.vectors = row if self.vectors is None or not len(self.entries) else np.vstack([self.vectors, row])
+            self.entries.append((num_chunks, response, time.monotonic() + self.ttl))
+
+    def _expire(self):
+        now = time.monotonic()
+        keep = [i for i, entry in enumerate(self.entries) if entry[2] >= now]
+        if len(keep) != len(self.entries):
+            self.vectors = self.vectors[keep] if keep else None
+            self.entries = [self.entries[i] for i in keep]
+
+    def clear(self):
+        with self.lock:
+            self.vectors = None
+            self.entries = []
+            self.generation += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": ANSWER_CACHE_ENABLED,
+                "entries": len(self.entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+answer_cache = SemanticAnswerCache()
+
+async def post_json(url, payload, timeout, idempotent=True):
+    """POST through the shared client, retrying transient upstream failures
+
+    Non-idempotent calls are only retried when the connection could not be
+    made, so a request the upstream may already have processed is never re-sent.
+    """
+    timeout = httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT_S)
+    retryable_errors = httpx.TransportError if idempotent else CONNECT_ERRORS
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            resp = await http_client.post(url, json=payload, timeout=timeout)
+            if not idempotent or resp.status_code not in RETRY_STATUS_CODES or attempt == HTTP_RETRIES:
+                return resp
+        except retryable_errors:
+            if attempt == HTTP_RETRIES:
+                raise
+        await asyncio.sleep(HTTP_RETRY_BACKOFF_S * (2 ** attempt))
+
+def upstream_error(resp, service):
+    """HTTPException for a failed upstream call: client errors pass through, the rest become 502"""
+    if 400 <= resp.status_code < 500:
+        try:
+            detail = resp.json().get("detail", resp.text)
+        except ValueError:
+            detail = resp.text
+        return HTTPException(status_code=resp.status_code, detail=detail)
+    return HTTPException(status_code=502, detail=f"{service} service failed")
+
+async def embed_question(question):
+    """Get the question embedding from the retrieval service"""
+    if PIPELINE_MODE == "fused":
+        return await app_retrieve.embed_question(question)
+    
+    resp = await post_json(EMBED_URL, {"question": question}, EMBED_TIMEOUT_S)
+    if resp.status_code != 200:
+        raise HTTPException(status_code=502, detail="Embedding service failed")
+    return resp.json()["embedding"]
+
+async def retrieve_chunks(question, num_chunks):
+    """Get relevant chunks, in-process or from the retrieval service"""
+    if PIPELINE_MODE == "fused":
+        return await app_retrieve.retrieve_chunks(question, num_chunks)
+    
+    retrieve_payload = {
+        "question": question,
+        "num_chunks": num_chunks
+    }
+    
+    retrieve_resp = await post_json(RETRIEVE_URL, retrieve_payload, RETRIEVE_TIMEOUT_S)
+    if retrieve_resp.status_code != 200:
+        raise upstream_error(retrieve_resp, "Retrieval")
+    
+    return retrieve_resp.json()["chunks"]
+
+async def generate_answer(question, chunks):
+    """Get the answer as (answer, sources, runtime_ms, prompt_tokens), in-process or from the answer service"""
+    if PIPELINE_MODE == "fused":
+        result = await app_answer.generate_answer(question, chunks)
+        return result.answer, result.sources, result.runtime_ms, result.prompt_tokens
+    
+    answer_payload = {
+        "question": question,
+        "chunks": chunks
+    }
+    
+    # Generation is not idempotent (and Groq retries happen in the answer service)
+    answer_resp = await post_json(ANSWER_URL, answer_payload, ANSWER_TIMEOUT_S, idempotent=False)
+    if answer_resp.status_code != 200:
+        raise upstream_error(answer_resp, "Answer")
+    
+    answer_data = answer_resp.json()
+    return answer_data["answer"], answer_data["sources"], answer_data["runtime_ms"], answer_data.get("prompt_tokens")
+
+async def stream_answer(question, chunks):
+    """Stream answer events, in-process or relayed from the answer service"""
+    if PIPELINE_MODE == "fused":
+        async for event in app_answer.stream_answer(question, chunks):
+            yield event
+        return
+    
+    answer_payload = {
+        "question": question,
+        "chunks": chunks,
+        "stream": True
+    }
+    timeout = httpx.Timeout(ANSWER_TIMEOUT_S, connect=HTTP_CONNECT_TIMEOUT_S)
+    async with http_client.stream("POST", ANSWER_URL, json=answer_payload, timeout=timeout) as resp:
+        if resp.status_code != 200:
+            yield {"type": "error", "detail": "Answer service failed"}
+            return
+        async for line in resp.aiter_lines():
+            if line.startswith("data:"):
+                yield json.loads(line[len("data:"):].strip())
+
+def sse_event(payload):
+    """Format one Server-Sent Event"""
+    return f"data: {json.dumps(payload)}\n\n"
+
+async def lookup_cached_answer(question, num_chunks):
+    """Check the answer cache before running the pipeline
+
+    Returns (cached response or None, question embedding or None, cache
+    generation). The generation is read before retrieval, so an
+    invalidation during this query discards its answer.
+    """
+    q_embedding = None
+    cache_generation = answer_cache.generation
+    if ANSWER_CACHE_ENABLED:
+        try:
+            q_embedding = await embed_question(question)
+        except Exception as e:
+            print(f"Answer cache lookup skipped: {e}")
+        if q_embedding is not None:
+            cached = answer_cache.lookup(q_embedding, num_chunks)
+            if cached is not None:
+                return cached, q_embedding, cache_generation
+    return None, q_embedding, cache_generation
+
+async def query_events(question, num_chunks):
+    """Run the query pipeline, yielding SSE frames as the answer is generated"""
+    try:
+        cached, q_embedding, cache_generation = await lookup_cached_answer(question, num_chunks)
+        if cached is not None:
+            yield sse_event({"type": "token", "content": cached.answer})
+            yield sse_event({
+                "type": "done",
+                "sources": cached.sources,
+                "runtime_ms": cached.runtime_ms,
+                "cached": True
+            })
+            return
+        
+        chunks = await retrieve_chunks(question, num_chunks)
+        if not chunks:
+            yield sse_event({
+                "type": "token",
+                "content": "I couldn't find any relevant information to answer your question."
+            })
+            yield sse_event({"type": "done", "sources": [], "runtime_ms": 0})
+            return
+        
+        parts = []
+        async for event in stream_answer(question, chunks):
+            if event.get("type") == "token":
+                parts.append(event["content"])
+            elif event.get("type") == "done" and q_embedding is not None:
+                answer_cache.store(q_embedding, num_chunks, QueryResponse(
+                    question=question,
+                    answer="".join(parts).strip(),
+                    sources=event.get("sources", []),
+                    runtime_ms=event.get("runtime_ms", 0),
+                    prompt_tokens=event.get("prompt_tokens")
+                ), cache_generation)
+            yield sse_event(event)
+        
+    except HTTPException as e:
+        yield sse_event({"type": "error", "detail": e.detail})
+    except httpx.HTTPError as e:
+        yield sse_event({"type": "error", "detail": f"Service communication failed: {e}"})
+    except Exception as e:
+        yield sse_event({"type": "error", "detail": f"Query processing failed: {e}"})
 
 @app.get("/")
 async def root():
     return {"message": "RAG Combined API is running"}
 
+@app.get("/cache/stats")
+async def cache_stats():
+    return answer_cache.stats()
+
+@app.post("/cache/invalidate")
+async def cache_invalidate():
+    """Drop every cached answer, e.g. after the document set changes"""
+    answer_cache.clear()
+    return {"status": "invalidated"}
+
 @app.post("/query", response_model=QueryResponse)
 async def query(req: QueryRequest):
     question = req.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
     
+    if req.stream:
+        # Server-Sent Events: token frames as they are generated, then a done frame
+        return StreamingResponse(
+            query_events(question, req.num_chunks),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    
     try:
-        # Step 1: Retrieve relevant chunks
-        retrieve_payload = {
-            "question": question,
-            "num_chunks": req.num_chunks
-        }
-        
-        retrieve_resp = requests.post(RETRIEVE_URL, json=retrieve_payload, timeout=30)
-        if retrieve_resp.status_code != 200:
-            raise HTTPException(status_code=502, detail="Retrieval service failed")
+        # Step 0: Serve near-duplicate questions from the answer cache
+        cached, q_embedding, cache_generation = await lookup_cached_answer(question, req.num_chunks)
+        if cached is not None:
+            return cached.model_copy(update={"question": question, "cached": True})
         
-        retrieve_data = retrieve_resp.json()
-        chunks = retrieve_data["chunks"]
+        # Step 1: Retrieve relevant chunks
+        chunks = await retrieve_chunks(question, req.num_chunks)
         
         if not chunks:
             return QueryResponse(
@@ -67,25 +388,23 @@ async def query(req: QueryRequest):
             )
         
         # Step 2: Generate answer
-        answer_payload = {
-            "question": question,
-            "chunks": chunks
-        }
+        answer, sources, runtime_ms, prompt_tokens = await generate_answer(question, chunks)
         
-        answer_resp = requests.post(ANSWER_URL, json=answer_payload, timeout=60)
-        if answer_resp.status_code != 200:
-            raise HTTPException(status_code=502, detail="Answer service failed")
-        
-        answer_data = answer_resp.json()
-        
-        return QueryResponse(
+        response = QueryResponse(
             question=question,
-            answer=answer_data["answer"],
-            sources=answer_data["sources"],
-            runtime_ms=answer_data["runtime_ms"]
+            answer=answer,
+            sources=sources,
+            runtime_ms=runtime_ms,
+            prompt_tokens=prompt_tokens
         )
+        if q_embedding is not None:
+            answer_cache.store(q_embedding, req.num_chunks, response, cache_generation)
+        
+        return response
         
-    except requests.exceptions.RequestException as e:
+    except HTTPException:
+        raise
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=502, detail=f"Service communication failed: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query processing failed: {e}")
@@ -1,44 +1,536 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from sentence_transformers import SentenceTransformer
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from psycopg2 import pool as pg_pool
 import psycopg2
+import httpx
 import os
+import re
+import hashlib
+import asyncio
+import threading
+import time
+import numpy as np
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from dotenv import load_dotenv
-from typing import List
+from typing import List, Optional
+from vector_index import MemoryVectorIndex
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="RAG Retrieval API", version="1.0.0")
+# Connection pool settings
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "10"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+# Distance metric; must match VECTOR_METRIC in scripts/manage_index.py so the index is used.
+# Stored embeddings and questions are both normalized, so ip (dot product) ranks like cosine.
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "ip").lower()
+VECTOR_OPERATORS = {
+    "l2": "<->",
+    "cosine": "<=>",
+    "ip": "<#>",  # negative inner product, so ascending order is still best-first
+}
+if VECTOR_METRIC not in VECTOR_OPERATORS:
+    raise ValueError(f"VECTOR_METRIC must be one of {sorted(VECTOR_OPERATORS)}, got {VECTOR_METRIC!r}")
+VECTOR_OPERATOR = VECTOR_OPERATORS[VECTOR_METRIC]
+
+# Retrieval mode: "vector" (ANN only) or "hybrid" (ANN + full-text, fused with RRF)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector").lower()
+RETRIEVAL_MODES = ("vector", "hybrid")
+# Each hybrid leg fetches num_chunks * this many candidates before fusion
+HYBRID_CANDIDATE_FACTOR = int(os.getenv("HYBRID_CANDIDATE_FACTOR", "2"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+# Words too common to help the lexical leg (the 'simple' text search config keeps every word)
+LEXICAL_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from",
+    "how", "i", "in", "is", "it", "me", "of", "on", "or", "show", "tell", "that", "the",
+    "there", "this", "to", "was", "were", "what", "when", "where", "which", "who", "why",
+    "with", "you", "your",
+}
+
+# Optional cross-encoder rerank: over-fetch candidates, keep the best RERANK_TOP_N
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").lower() == "true"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+
+# Optional in-process vector index: exact top-k over a memory-mapped snapshot of
+# doc_chunks.embedding, so Postgres only fetches the winners' text.
+# MEMORY_INDEX_PATH is a directory of versioned snapshots.
+MEMORY_INDEX_ENABLED = os.getenv("MEMORY_INDEX_ENABLED", "false").lower() == "true"
+MEMORY_INDEX_DTYPE = os.getenv("MEMORY_INDEX_DTYPE", "float32").lower()  # float32 or int8
+MEMORY_INDEX_PATH = os.getenv(
+    "MEMORY_INDEX_PATH", str(Path(__file__).parent.parent / "data" / "vector_index" / "chunks")
+)
+MEMORY_INDEX_SYNC_S = float(os.getenv("MEMORY_INDEX_SYNC_S", "30"))
+# Answers cached by the combined API before a sync may miss the rows it added or
+# removed, so the cache is cleared again once the index sees them
+CACHE_INVALIDATE_URL = os.getenv("CACHE_INVALIDATE_URL", "http://localhost:8002/cache/invalidate")
+# Re-read rows embedded this long before the last sync, since NOW() is the
+# transaction start and a slow writer can commit behind the watermark
+MEMORY_INDEX_SYNC_LOOKBACK_S = float(os.getenv("MEMORY_INDEX_SYNC_LOOKBACK_S", "300"))
+# Rows embedded since the snapshot that trigger writing a new one
+MEMORY_INDEX_SNAPSHOT_ROWS = int(os.getenv("MEMORY_INDEX_SNAPSHOT_ROWS", "10000"))
+# Rows scored per matrix-vector block (bounds the temporary float32 copy for int8)
+MEMORY_INDEX_BLOCK_ROWS = int(os.getenv("MEMORY_INDEX_BLOCK_ROWS", "8192"))
+# Extra ids searched to make up for chunks deleted since the last sync
+MEMORY_INDEX_OVERFETCH = int(os.getenv("MEMORY_INDEX_OVERFETCH", "8"))
+MEMORY_INDEX_FETCH_ROWS = 5000
+EMBEDDING_DIM = 768
+
+# Post-processing: merge hits that are neighbours in the same document into one span,
+# optionally after widening every hit by this many chunks on each side
+CONTEXT_MERGE_ADJACENT = os.getenv("CONTEXT_MERGE_ADJACENT", "true").lower() == "true"
+CONTEXT_EXPAND_NEIGHBORS = int(os.getenv("CONTEXT_EXPAND_NEIGHBORS", "0"))
+# Longest word overlap looked for when joining neighbours (ingest overlap is 150 words)
+MERGE_MAX_OVERLAP_WORDS = int(os.getenv("MERGE_MAX_OVERLAP_WORDS", "200"))
+# Longest merged span in chunks; longer runs are split so one span cannot fill the context
+CONTEXT_MAX_SPAN_CHUNKS = int(os.getenv("CONTEXT_MAX_SPAN_CHUNKS", "3"))
+
+# Order in which chunk types fill table-like answers (chunk_type is set at ingest)
+CHUNK_TYPE_PRIORITY = {"table": 0, "table_part": 1, "text": 2}
+
+# ANN search quality/speed knobs, applied per query (see scripts/manage_index.py)
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", "10"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "40"))
+
+# Query embedding micro-batching settings
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "8"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+
+# Query embedding cache settings
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", "64"))
+EMBED_CACHE_TTL_S = float(os.getenv("EMBED_CACHE_TTL_S", "3600"))
+
+db_pool = None
+db_pool_slots = None
+
+def init_db_pool():
+    """Create the shared connection pool"""
+    global db_pool, db_pool_slots
+    if db_pool is not None:
+        return
+    conn_params = {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT'),
+        # Server-side per-query timeout so one slow query cannot hold a connection forever
+        'options': f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    }
+    db_pool = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **conn_params)
+    # ThreadedConnectionPool raises instead of waiting when exhausted, so gate it
+    db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+    print(f"Database pool ready (min={DB_POOL_MIN}, max={DB_POOL_MAX})")
+
+def close_db_pool():
+    """Close every connection held by the pool"""
+    global db_pool, db_pool_slots
+    if db_pool is not None:
+        db_pool.closeall()
+        db_pool = None
+        db_pool_slots = None
+        print("Database pool closed")
+
+class EmbeddingBatcher:
+    """Coalesce concurrent questions into one batched encode call on a worker thread"""
+
+    def __init__(self, model, window_ms=EMBED_BATCH_WINDOW_MS, max_batch=EMBED_MAX_BATCH):
+        self.model = model
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue = None
+        self.worker = None
+        self.executor = None
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        # A single thread owns the model, so batches never compete for CPU
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def embed(self, text):
+        """Queue a question and wait for its embedding"""
+        if self.worker is None:
+            raise RuntimeError("Embedding batcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    def _encode(self, texts):
+        # Normalized like the stored chunk embeddings (see scripts/embed_chunks.py)
+        return self.model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                 normalize_embeddings=True)
+
+    @staticmethod
+    def _fail(batch, error):
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    async def _run(self):
+        # One bad batch must not end the loop, or every caller would wait forever
+        while True:
+            batch = []
+            try:
+                batch.append(await self.queue.get())
+                # Give concurrent callers a short window to join this batch
+                if self.queue.qsize() < self.max_batch - 1:
+                    await asyncio.sleep(self.window)
+                while len(batch) < self.max_batch and not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                await self._process(batch)
+            except asyncio.CancelledError:
+                # Stopping: fail this batch and everything still queued
+                while not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                self._fail(batch, RuntimeError("Embedding batcher stopped"))
+                raise
+            except Exception as e:
+                print(f"Embedding batcher error: {e}")
+                self._fail(batch, e)
+
+    async def _process(self, batch):
+        # Skip callers that gave up while waiting
+        batch = [(text, future) for text, future in batch if not future.done()]
+        if not batch:
+            return
+        
+        # Encode each distinct text once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self._encode, texts)
+        
+        by_text = dict(zip(texts, vectors))
+        for text, future in batch:
+            if not future.done():
+                future.set_result(by_text[text])
+
+class EmbeddingCache:
+    """Memory-bounded LRU cache of whitespace-normalized question -> float32 embedding, with TTL"""
+
+    def __init__(self, max_mb=EMBED_CACHE_MAX_MB, ttl_s=EMBED_CACHE_TTL_S):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl_s
+        self.entries = OrderedDict()  # key -> (vector, expires_at, size)
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(question):
+        # Whitespace only: casing changes the embedding, so it must stay part of the key
+        return " ".join(question.split())
+
+    def get(self, question):
+        key = self.normalize(question)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            vector, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return vector
+
+    def put(self, question, vector):
+        key = self.normalize(question)
+        vector = np.asarray(vector, dtype=np.float32)
+        size = vector.nbytes + len(key.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (vector, time.monotonic() + self.ttl, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.current_bytes -= size
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+class Reranker:
+    """Score (question, chunk) pairs with a local cross-encoder, caching scores per (question, chunk_id)"""
+
+    def __init__(self, model_name=RERANK_MODEL, cache_size=RERANK_CACHE_SIZE):
+        self.model_name = model_name
+        self.model = None
+        self.executor = None
+        self.scores = OrderedDict()  # (question hash, chunk_id) -> score, LRU order
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        # One thread owns the model, like the embedding batcher
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    def stop(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def _load(self):
+        if self.model is None:
+            print(f"Loading rerank model {self.model_name}...")
+            self.model = CrossEncoder(self.model_name, max_length=RERANK_MAX_LENGTH, device="cpu")
+            print("Rerank model loaded!")
+
+    async def load(self):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self._load)
+
+    def _predict(self, pairs):
+        self._load()
+        return self.model.predict(pairs, batch_size=RERANK_BATCH_SIZE, convert_to_numpy=True,
+                                  show_progress_bar=False)
+
+    async def rerank(self, question, rows, top_n):
+        """Return (best top_n rows, number of scores served from the cache)"""
+        question_key = hashlib.sha1(EmbeddingCache.normalize(question).encode("utf-8")).hexdigest()
+        scores = {}
+        missing = []
+        for row in rows:
+            key = (question_key, row[0])
+            if key in self.scores:
+                self.scores.move_to_end(key)
+                scores[row[0]] = self.scores[key]
+            else:
+                missing.append(row)
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        
+        if missing:
+            # All uncached pairs in one batched call
+            predicted = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._predict, [(question, row[1]) for row in missing]
+            )
+            for row, score in zip(missing, predicted):
+                scores[row[0]] = float(score)
+                self.scores[(question_key, row[0])] = float(score)
+            while len(self.scores) > self.cache_size:
+                self.scores.popitem(last=False)
+        
+        ranked = sorted(rows, key=lambda row: scores[row[0]], reverse=True)
+        return ranked[:top_n], len(rows) - len(missing)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model_loaded": self.model is not None,
+            "entries": len(self.scores),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
 
 # Load embedding model once at startup
 print("Loading embedding model...")
 embed_model = SentenceTransformer("Alibaba-NLP/gte-multilingual-base", trust_remote_code=True)
 print("Embedding model loaded!")
 
+embed_batcher = EmbeddingBatcher(embed_model)
+embed_cache = EmbeddingCache()
+reranker = Reranker()
+memory_index = MemoryVectorIndex(
+    MEMORY_INDEX_PATH, MEMORY_INDEX_DTYPE, EMBEDDING_DIM, CHUNK_TYPE_PRIORITY,
+    lookback_s=MEMORY_INDEX_SYNC_LOOKBACK_S, snapshot_rows=MEMORY_INDEX_SNAPSHOT_ROWS,
+    block_rows=MEMORY_INDEX_BLOCK_ROWS, fetch_rows=MEMORY_INDEX_FETCH_ROWS
+) if MEMORY_INDEX_ENABLED else None
+memory_index_task = None
+lexical_available = False
+
+async def sync_memory_index():
+    """Keep the in-memory vector index up to date with newly embedded chunks"""
+    while True:
+        try:
+            added, removed = await run_in_threadpool(memory_index.sync, get_db_connection)
+            if added or removed:
+                print(f"Vector index synced: {added} new or updated embeddings, {removed} removed")
+                await invalidate_answer_cache()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Vector index sync failed: {e}")
+        await asyncio.sleep(MEMORY_INDEX_SYNC_S)
+
+async def invalidate_answer_cache():
+    """Tell the combined API to drop cached answers (best effort)"""
+    try:
+        async with httpx.AsyncClient(timeout=5) as client:
+            await client.post(CACHE_INVALIDATE_URL)
+    except httpx.HTTPError as e:
+        print(f"Answer cache invalidation failed: {e}")
+
+async def embed_question(question):
+    """Return the question embedding, using the cache before the model"""
+    # Encode exactly the text the cache is keyed on
+    question = EmbeddingCache.normalize(question)
+    vector = embed_cache.get(question)
+    if vector is None:
+        vector = await embed_batcher.embed(question)
+        embed_cache.put(question, vector)
+    return vector
+
+def has_lexical_column():
+    """Whether setup_database has added the full-text column hybrid retrieval needs"""
+    rows = fetch_all("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'doc_chunks' AND column_name = 'chunk_tsv';
+    """)
+    return bool(rows)
+
+async def startup():
+    """Open the pool and start the embedding and rerank workers (also used by fused mode)"""
+    global memory_index_task, lexical_available
+    await run_in_threadpool(init_db_pool)
+    lexical_available = await run_in_threadpool(has_lexical_column)
+    if not lexical_available:
+        print("Warning: doc_chunks.chunk_tsv is missing (run setup_database.py), hybrid retrieval will use vectors only")
+    embed_batcher.start()
+    reranker.start()
+    if RERANK_ENABLED:
+        await reranker.load()
+    if memory_index is not None:
+        # Searches use Postgres until the snapshot is mapped or the first full load finishes
+        await run_in_threadpool(memory_index.load)
+        memory_index_task = asyncio.create_task(sync_memory_index())
+
+async def shutdown():
+    global memory_index_task
+    if memory_index_task is not None:
+        memory_index_task.cancel()
+        try:
+            await memory_index_task
+        except asyncio.CancelledError:
+            pass
+        memory_index_task = None
+    await embed_batcher.stop()
+    reranker.stop()
+    await run_in_threadpool(close_db_pool)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
+
+app = FastAPI(title="RAG Retrieval API", version="1.0.0", lifespan=lifespan)
+
 class RetrieveRequest(BaseModel):
     question: str
     num_chunks: int = 10
+    mode: Optional[str] = None  # "vector" or "hybrid", defaults to RETRIEVAL_MODE
+    expand_neighbors: Optional[int] = None  # defaults to CONTEXT_EXPAND_NEIGHBORS
+    rerank: Optional[bool] = None  # defaults to RERANK_ENABLED
 
 class Chunk(BaseModel):
     chunk_id: int
     chunk_text: str
     source_name: str
+    doc_id: Optional[int] = None
+    chunk_index: Optional[int] = None  # first chunk of a merged span
+    # Character range of the best hit inside a merged span, kept when the span is truncated
+    hit_start: Optional[int] = None
+    hit_end: Optional[int] = None
 
 class RetrieveResponse(BaseModel):
     chunks: List[Chunk]
     total_found: int
+    rerank_ms: Optional[int] = None
+    rerank_candidates: Optional[int] = None
+    rerank_cached: Optional[int] = None
 
+class EmbedRequest(BaseModel):
+    question: str
+
+class EmbedResponse(BaseModel):
+    embedding: List[float]
+
+@contextmanager
 def get_db_connection():
-    """Create and return database connection"""
-    conn_params = {
-        'dbname': os.getenv('DB_NAME'),
-        'user': os.getenv('DB_USER'),
-        'password': os.getenv('DB_PASSWORD'),
-        'host': os.getenv('DB_HOST'),
-        'port': os.getenv('DB_PORT')
-    }
-    return psycopg2.connect(**conn_params)
+    """Borrow a connection from the pool and return it when done"""
+    if db_pool is None:
+        raise RuntimeError("Database pool is not initialized")
+    if not db_pool_slots.acquire(timeout=DB_POOL_ACQUIRE_TIMEOUT):
+        raise TimeoutError("Timed out waiting for a database connection")
+    conn = None
+    broken = False
+    try:
+        conn = db_pool.getconn()
+        yield conn
+    finally:
+        if conn is not None:
+            if not conn.closed:
+                try:
+                    # End the read transaction so the connection goes back clean
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            db_pool.putconn(conn, close=broken or bool(conn.closed))
+        db_pool_slots.release()
+
+def search_settings(num_chunks):
+    """SET LOCAL statements for the ANN index; they last only for the query's transaction"""
+    # hnsw.ef_search caps how many rows an HNSW scan can return
+    ef_search = max(HNSW_EF_SEARCH, int(num_chunks))
+    return f"SET LOCAL ivfflat.probes = {IVFFLAT_PROBES}; SET LOCAL hnsw.ef_search = {ef_search}; "
+
+def fetch_all(sql, params=None, settings=""):
+    """Run a query on a pooled connection and return all rows (blocking)
+
+    settings is prepended to the query so it costs no extra round-trip.
+    """
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(settings + sql, params)
+            return cur.fetchall()
 
 @app.get("/")
 async def root():
@@ -47,26 +539,107 @@ async def root():
 @app.get("/health")
 async def health_check():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NOT NULL;")
-        embedded_chunks = cur.fetchone()[0]
-        cur.close()
-        conn.close()
+        rows = await run_in_threadpool(
+            fetch_all, "SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NOT NULL;"
+        )
+        embedded_chunks = rows[0][0]
         
         return {
             "status": "healthy",
-            "embedded_chunks": embedded_chunks
+            "embedded_chunks": embedded_chunks,
+            "embedding_cache": embed_cache.stats()
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {e}")
 
-@app.post("/retrieve", response_model=RetrieveResponse)
-async def retrieve(req: RetrieveRequest):
+@app.get("/metrics")
+async def metrics():
+    return {
+        "embedding_cache": embed_cache.stats(),
+        "rerank": reranker.stats(),
+        "memory_index": memory_index.stats() if memory_index is not None else {"enabled": False}
+    }
+
+@app.post("/embed", response_model=EmbedResponse)
+async def embed(req: EmbedRequest):
     question = req.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
     
+    try:
+        vector = await embed_question(question)
+        return EmbedResponse(embedding=vector.tolist())
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Embedding failed: {e}")
+
+def lexical_terms(question):
+    """The question's distinctive terms, with codes like AB-1234 or 3.5.1 kept whole"""
+    terms = []
+    for term in re.findall(r"\w+(?:[-./:]\w+)*", question.lower()):
+        if term in LEXICAL_STOPWORDS or (len(term) < 2 and not term.isdigit()):
+            continue
+        if term not in terms:
+            terms.append(term)
+    return terms
+
+async def lexical_search(question, limit):
+    """Full-text top-k over the GIN-indexed chunk_tsv column
+
+    Terms are OR-ed. Each goes through plainto_tsquery, which parses a code
+    like "ab-1234" the same way as the indexed text (the whole code and its
+    parts, all required), so exact identifiers match and rank highest.
+    """
+    if not lexical_available:
+        return []
+    terms = lexical_terms(question)
+    if not terms:
+        return []
+    ts_query = " || ".join(["plainto_tsquery('simple', %s)"] * len(terms))
+    sql = f"""
+    SELECT dc.chunk_id, dc.chunk_text, d.source_name, dc.doc_id, dc.chunk_index
+    FROM doc_chunks dc
+    JOIN documents d ON dc.doc_id = d.id,
+         ({ts_query}) AS query
+    WHERE dc.chunk_tsv @@ query AND dc.embedding IS NOT NULL
+    ORDER BY ts_rank_cd(dc.chunk_tsv, query) DESC
+    LIMIT %s;
+    """
+    return await run_in_threadpool(fetch_all, sql, (*terms, limit))
+
+def fetch_chunks_by_id(chunk_ids):
+    """Rows for the given chunk ids in the same order, skipping chunks that no longer exist"""
+    if not chunk_ids:
+        return []
+    sql = """
+    SELECT dc.chunk_id, dc.chunk_text, d.source_name, dc.doc_id, dc.chunk_index
+    FROM doc_chunks dc
+    JOIN documents d ON dc.doc_id = d.id
+    WHERE dc.chunk_id = ANY(%s);
+    """
+    rows_by_id = {row[0]: row for row in fetch_all(sql, (chunk_ids,))}
+    return [rows_by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in rows_by_id]
+
+def memory_search(q_embedding, num_chunks, table_aware):
+    """vector_search over the in-memory index; Postgres only supplies the winners' text"""
+    limit = num_chunks + MEMORY_INDEX_OVERFETCH
+    while True:
+        if table_aware:
+            # Same order as the SQL path: chunk type priority, then distance
+            chunk_ids = []
+            for code in sorted(CHUNK_TYPE_PRIORITY.values()):
+                chunk_ids.extend(memory_index.search(q_embedding, limit, code))
+                if len(chunk_ids) >= limit:
+                    break
+        else:
+            chunk_ids = memory_index.search(q_embedding, limit)
+        rows = fetch_chunks_by_id(chunk_ids[:limit])
+        # Ids deleted since the last sync took the place of live ones: search deeper
+        if len(rows) >= num_chunks or len(chunk_ids) < limit:
+            return rows[:num_chunks]
+        limit *= 2
+
+async def vector_search(question, num_chunks):
+    """ANN top-k, with table chunks first for table-like questions"""
     # More precise table query detection
     table_keywords = ['table', 'compare', 'list all', 'show all', 'what are the', 'values', 'data', 'rows', 'columns']
     numerical_keywords = ['how much', 'how many', 'percentage', 'rate', 'amount', 'total', 'sum', 'average', 'maximum', 'minimum', 'cost', 'price', 'number']
@@ -77,66 +650,211 @@ async def retrieve(req: RetrieveRequest):
         any(keyword in question.lower() for keyword in numerical_keywords)
     )
     
-    try:
-        # Embed the question
-        q_vec = embed_model.encode(question).tolist()
-        
-        conn = get_db_connection()
-        cur = conn.cursor()
+    # Embed the question
+    q_embedding = await embed_question(question)
+    if memory_index is not None and memory_index.ready:
+        return await run_in_threadpool(memory_search, q_embedding, num_chunks, is_likely_table_query)
+    q_vec = q_embedding.tolist()
+    
+    if is_likely_table_query:
+        # For potential table queries, prioritize table chunks but also include regular text.
+        # chunk_type is stored at ingest, so each leg is an index-backed top-k
+        # (partial indexes for the table types, the main index for text) and the
+        # legs are merged by priority, then distance.
+        legs = []
+        for chunk_type, priority in CHUNK_TYPE_PRIORITY.items():
+            legs.append(f"""
+            (SELECT dc.chunk_id, dc.chunk_text, d.source_name, dc.doc_id, dc.chunk_index,
+                    dc.embedding {VECTOR_OPERATOR} %(q_vec)s::vector AS distance,
+                    {priority} AS chunk_priority
+             FROM doc_chunks dc
+             JOIN documents d ON dc.doc_id = d.id
+             WHERE dc.chunk_type = '{chunk_type}' AND dc.embedding IS NOT NULL
+             ORDER BY dc.embedding {VECTOR_OPERATOR} %(q_vec)s::vector
+             LIMIT %(num_chunks)s)""")
+        sql = " UNION ALL ".join(legs) + ";"
+        params = {"q_vec": q_vec, "num_chunks": num_chunks}
         
-        if is_likely_table_query:
-            # For potential table queries, prioritize table chunks but also include regular text
-            sql = """
-            WITH ranked_chunks AS (
-                SELECT dc.chunk_id, dc.chunk_text, d.source_name,
-                       dc.embedding <-> %s::vector as distance,
-                       CASE 
-                           WHEN dc.chunk_text LIKE '%%TABLE DATA:%%' THEN 0
-                           WHEN dc.chunk_text LIKE '%%|%%' AND 
-                                (dc.chunk_text LIKE '%%---|%%' OR 
-                                 LENGTH(dc.chunk_text) - LENGTH(REPLACE(dc.chunk_text, '|', '')) > 10)
-                           THEN 1
-                           ELSE 2 
-                       END as chunk_priority
-                FROM doc_chunks dc
-                JOIN documents d ON dc.doc_id = d.id
-                WHERE dc.embedding IS NOT NULL
-                ORDER BY chunk_priority, distance
-                LIMIT %s
-            )
-            SELECT chunk_id, chunk_text, source_name FROM ranked_chunks
-            ORDER BY chunk_priority, distance;
-            """
+        rows = await run_in_threadpool(fetch_all, sql, params, search_settings(num_chunks))
+        return [row[:5] for row in sorted(rows, key=lambda row: (row[6], row[5]))[:num_chunks]]
+    
+    # Regular semantic search
+    sql = f"""
+    SELECT dc.chunk_id, dc.chunk_text, d.source_name, dc.doc_id, dc.chunk_index
+    FROM doc_chunks dc
+    JOIN documents d ON dc.doc_id = d.id
+    WHERE dc.embedding IS NOT NULL
+    ORDER BY dc.embedding {VECTOR_OPERATOR} %s::vector
+    LIMIT %s;
+    """
+    return await run_in_threadpool(fetch_all, sql, (q_vec, num_chunks), search_settings(num_chunks))
+
+def rrf_merge(rankings, limit, k=RRF_K):
+    """Reciprocal-rank fusion of several ranked row lists, keyed by chunk_id"""
+    scores = {}
+    rows_by_id = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row[0]] = scores.get(row[0], 0.0) + 1.0 / (k + rank)
+            rows_by_id.setdefault(row[0], row)
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [rows_by_id[chunk_id] for chunk_id in best]
+
+def fetch_neighbors(rows, expand):
+    """Rows within +-expand chunks of each hit, fetched with one (doc_id, chunk_index) index query"""
+    sql = """
+    SELECT dc.chunk_id, dc.chunk_text, d.source_name, dc.doc_id, dc.chunk_index
+    FROM unnest(%s::int[], %s::int[], %s::int[]) AS w(doc_id, lo, hi)
+    JOIN doc_chunks dc ON dc.doc_id = w.doc_id AND dc.chunk_index BETWEEN w.lo AND w.hi
+    JOIN documents d ON dc.doc_id = d.id;
+    """
+    return fetch_all(sql, (
+        [row[3] for row in rows],
+        [row[4] - expand for row in rows],
+        [row[4] + expand for row in rows]
+    ))
+
+def join_overlapping(text, next_text):
+    """Append next_text to text, skipping words that repeat the end of text
+
+    Returns (merged text, offset of next_text's first word in it).
+    """
+    spans = [m.span() for m in re.finditer(r"\S+", next_text)]
+    if not spans:
+        return text + next_text, len(text)
+    tail_spans = [m.span() for m in re.finditer(r"\S+", text)][-MERGE_MAX_OVERLAP_WORDS:]
+    if not tail_spans:
+        return text + next_text, len(text) + spans[0][0]
+    
+    tail = [text[start:end] for start, end in tail_spans]
+    head = [next_text[start:end] for start, end in spans[:len(tail)]]
+    # Longest suffix of tail equal to a prefix of head; candidates start where head[0] appears
+    for i, word in enumerate(tail):
+        overlap = len(tail) - i
+        if word == head[0] and overlap <= len(head) and tail[i:] == head[:overlap]:
+            if overlap == len(spans):
+                return text, tail_spans[i][0]
+            return text + " " + next_text[spans[overlap][0]:], tail_spans[i][0]
+    return text + "\n\n" + next_text, len(text) + 2 + spans[0][0]
+
+def merge_adjacent(rows, expand=0):
+    """Merge hits from consecutive chunks of a document into single de-duplicated spans
+
+    rows are (chunk_id, chunk_text, source_name, doc_id, chunk_index) in
+    relevance order. With expand, each hit is first widened to its
+    neighbours. Runs longer than CONTEXT_MAX_SPAN_CHUNKS are split. Spans
+    keep the rank of their best hit and the chunk_id of that hit, and add
+    the character range of that hit (hit_start, hit_end) to the row.
+    """
+    if not rows:
+        return rows
+    rank = {row[0]: position for position, row in enumerate(rows)}
+    by_doc = {}
+    for row in rows:
+        by_doc.setdefault(row[3], {})[row[4]] = row
+    if expand > 0:
+        for row in fetch_neighbors(rows, expand):
+            by_doc[row[3]].setdefault(row[4], row)
+    
+    spans = []  # (best rank, row)
+    for doc_rows in by_doc.values():
+        run = []
+        for index in sorted(doc_rows):
+            if run and (index != run[-1][4] + 1 or len(run) >= max(1, CONTEXT_MAX_SPAN_CHUNKS)):
+                spans.append(merge_run(run, rank))
+                run = []
+            run.append(doc_rows[index])
+        spans.append(merge_run(run, rank))
+    
+    spans.sort(key=lambda span: span[0])
+    return [row for _, row in spans]
+
+def merge_run(run, rank):
+    """Collapse consecutive chunks into one row ranked by its best hit"""
+    best = min(run, key=lambda row: rank.get(row[0], len(rank)))
+    text = ""
+    for row in run:
+        if text:
+            text, start = join_overlapping(text, row[1])
         else:
-            # Regular semantic search
-            sql = """
-            SELECT dc.chunk_id, dc.chunk_text, d.source_name
-            FROM doc_chunks dc
-            JOIN documents d ON dc.doc_id = d.id
-            WHERE dc.embedding IS NOT NULL
-            ORDER BY dc.embedding <-> %s::vector
-            LIMIT %s;
-            """
-        
-        cur.execute(sql, (q_vec, req.num_chunks))
-        rows = cur.fetchall()
-        
-        chunks = [
-            Chunk(
-                chunk_id=row[0],
-                chunk_text=row[1],
-                source_name=row[2]
-            ) for row in rows
-        ]
-        
-        cur.close()
-        conn.close()
+            text, start = row[1], 0
+        if row is best:
+            hit = (start, len(text))
+    return rank.get(best[0], len(rank)), (best[0], text, best[2], best[3], run[0][4], *hit)
+
+async def retrieve_chunks(question, num_chunks, mode=None, expand_neighbors=None, rerank=None, stats=None):
+    """Return the chunks most relevant to the question (core of /retrieve)
+
+    If stats is a dict, rerank timing and counts are recorded in it.
+    """
+    mode = (mode or RETRIEVAL_MODE).lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}, expected one of {RETRIEVAL_MODES}")
+    expand = CONTEXT_EXPAND_NEIGHBORS if expand_neighbors is None else expand_neighbors
+    rerank = RERANK_ENABLED if rerank is None else rerank
+    # Reranking over-fetches candidates and keeps only the best few
+    limit = max(num_chunks, RERANK_CANDIDATES) if rerank else num_chunks
+    
+    if mode == "hybrid":
+        # Both legs run concurrently on separate pooled connections;
+        # the lexical one does not wait for the question embedding
+        candidates = max(limit, limit * HYBRID_CANDIDATE_FACTOR)
+        vector_rows, lexical_rows = await asyncio.gather(
+            vector_search(question, candidates),
+            lexical_search(question, candidates)
+        )
+        rows = rrf_merge([vector_rows, lexical_rows], limit)
+    else:
+        rows = await vector_search(question, limit)
+    
+    if rerank and rows:
+        # Before merging, so neighbours are judged on their own text
+        t0 = time.perf_counter()
+        candidate_count = len(rows)
+        rows, cached = await reranker.rerank(question, rows, min(num_chunks, RERANK_TOP_N))
+        if stats is not None:
+            stats["rerank_ms"] = int((time.perf_counter() - t0) * 1000)
+            stats["rerank_candidates"] = candidate_count
+            stats["rerank_cached"] = cached
+    
+    if CONTEXT_MERGE_ADJACENT or expand > 0:
+        rows = await run_in_threadpool(merge_adjacent, rows, expand)
+    
+    return [
+        Chunk(
+            chunk_id=row[0],
+            chunk_text=row[1],
+            source_name=row[2],
+            doc_id=row[3],
+            chunk_index=row[4],
+            hit_start=row[5] if len(row) > 5 else None,
+            hit_end=row[6] if len(row) > 6 else None
+        ) for row in rows
+    ]
+
+@app.post("/retrieve", response_model=RetrieveResponse)
+async def retrieve(req: RetrieveRequest):
+    question = req.question.strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+    if req.mode and req.mode.lower() not in RETRIEVAL_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {RETRIEVAL_MODES}.")
+    if req.expand_neighbors is not None and req.expand_neighbors < 0:
+        raise HTTPException(status_code=400, detail="expand_neighbors cannot be negative.")
+    
+    try:
+        stats = {}
+        chunks = await retrieve_chunks(question, req.num_chunks, req.mode, req.expand_neighbors,
+                                       req.rerank, stats)
         
         return RetrieveResponse(
             chunks=chunks,
-            total_found=len(chunks)
+            total_found=len(chunks),
+            **stats
         )
         
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=f"Retrieval busy: {e}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Retrieval failed: {e}")
 
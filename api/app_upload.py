@@ -1,18 +1,59 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-import tempfile
+import asyncio
+import json
 import os
-import shutil
 from pathlib import Path
-import subprocess
 import sys
 from typing import Optional
-import asyncio
 import threading
 import time
+import uuid
+import requests
+from contextlib import asynccontextmanager
+from job_store import JobStore
+
+PROJECT_ROOT = Path(__file__).parent.parent
+# The ingestion and embedding modules are imported in-process by the workers
+sys.path.insert(0, str(PROJECT_ROOT / "scripts"))
+
+# Load the Docling and embedding models at startup instead of on the first upload
+INGEST_PRELOAD_MODELS = os.getenv("INGEST_PRELOAD_MODELS", "true").lower() == "true"
+
+# Durable job queue settings
+UPLOAD_JOBS_DB = os.getenv("UPLOAD_JOBS_DB", str(PROJECT_ROOT / "data" / "upload_jobs.sqlite3"))
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", str(PROJECT_ROOT / "data" / "uploads")))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "1"))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("UPLOAD_MAX_ATTEMPTS", "3"))
+UPLOAD_RETRY_BACKOFF_S = float(os.getenv("UPLOAD_RETRY_BACKOFF_S", "30"))
 
-app = FastAPI(title="RAG Upload API", version="1.0.0")
+# Progress granularity: pages converted per step and chunks embedded per step.
+# Page steps convert the PDF in separate slices, which splits tables and sections
+# crossing a slice boundary, so the default (0) converts the whole document at once
+# and conversion progress only moves when it finishes.
+UPLOAD_PAGES_PER_STEP = int(os.getenv("UPLOAD_PAGES_PER_STEP", "0"))
+UPLOAD_EMBED_STEP = int(os.getenv("UPLOAD_EMBED_STEP", "128"))
+# How often the event stream checks for job changes, and sends keep-alives
+EVENTS_POLL_S = float(os.getenv("UPLOAD_EVENTS_POLL_S", "0.25"))
+EVENTS_KEEPALIVE_S = float(os.getenv("UPLOAD_EVENTS_KEEPALIVE_S", "15"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    recovered, exhausted = await run_in_threadpool(job_store.recover)
+    if recovered:
+        print(f"Re-queued {recovered} jobs interrupted by a restart")
+    if exhausted:
+        print(f"Failed {len(exhausted)} interrupted jobs that were out of attempts")
+        for file_path in exhausted:
+            remove_upload(file_path)
+    ingestion_workers.start()
+    yield
+    ingestion_workers.stop()
+
+app = FastAPI(title="RAG Upload API", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -23,8 +64,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store processing status
-processing_status = {}
+# Combined API answer cache, invalidated whenever the document set changes
+CACHE_INVALIDATE_URL = os.getenv("CACHE_INVALIDATE_URL", "http://localhost:8002/cache/invalidate")
+
+def invalidate_answer_cache():
+    """Tell the combined API to drop cached answers (best effort)"""
+    try:
+        requests.post(CACHE_INVALIDATE_URL, timeout=5)
+    except requests.exceptions.RequestException as e:
+        print(f"Answer cache invalidation failed: {e}")
 
 class UploadResponse(BaseModel):
     success: bool
@@ -33,144 +81,231 @@ class UploadResponse(BaseModel):
 
 class StatusResponse(BaseModel):
     task_id: str
-    status: str  # "processing", "completed", "failed"
+    status: str  # "queued", "processing", "retrying", "completed", "failed"
     message: str
     progress: Optional[str] = None
+    attempts: int = 0
+    details: Optional[dict] = None
 
-def run_script(script_path: str, task_id: str):
-    """Run a Python script and update status"""
-    try:
-        processing_status[task_id] = {
-            "status": "processing",
-            "message": f"Running {script_path}...",
-            "progress": "Starting..."
-        }
-        
-        # Get the absolute path to the script
-        project_root = Path(__file__).parent.parent
-        full_script_path = project_root / "scripts" / script_path
-        
-        if not full_script_path.exists():
-            raise FileNotFoundError(f"Script not found: {full_script_path}")
-        
-        # Run the script
-        result = subprocess.run(
-            [sys.executable, str(full_script_path)],
-            capture_output=True,
-            text=True,
-            cwd=str(project_root)
-        )
+job_store = JobStore(UPLOAD_JOBS_DB, max_attempts=UPLOAD_MAX_ATTEMPTS, retry_backoff_s=UPLOAD_RETRY_BACKOFF_S)
+
+def job_event(job):
+    """Public view of a job row, as sent by /status and /events"""
+    return {
+        "task_id": job["task_id"],
+        "status": job["status"],
+        "message": job["message"],
+        "progress": job["progress"],
+        "attempts": job["attempts"],
+        "details": json.loads(job["details"]) if job.get("details") else None,
+        "updated_at": job["updated_at"]
+    }
+
+class JobProgress:
+    """Turns stage callbacks from the pipeline into a percentage and ETA
+
+    Conversion, chunking and embedding each own a slice of 0-100%, so the
+    bar moves with pages converted and chunks embedded, not fixed steps.
+    """
+
+    STAGES = {
+        "converting": (0, 60, "Converted {done}/{total} pages"),
+        "chunking": (60, 65, "Created {done} chunks"),
+        "embedding": (65, 100, "Embedded {done}/{total} chunks"),
+    }
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self.started = time.time()
+
+    def __call__(self, stage, done, total):
+        start, end, label = self.STAGES[stage]
+        fraction = (done / total) if total else 0.0
+        percent = start + (end - start) * min(fraction, 1.0)
+        elapsed = time.time() - self.started
+        eta_s = round(elapsed * (100 - percent) / percent, 1) if percent > 0 else None
         
-        if result.returncode == 0:
-            processing_status[task_id] = {
-                "status": "completed",
-                "message": f"Successfully completed {script_path}",
-                "progress": "100%"
-            }
-        else:
-            processing_status[task_id] = {
-                "status": "failed",
-                "message": f"Script failed: {result.stderr}",
-                "progress": "Failed"
-            }
-            
-    except Exception as e:
-        processing_status[task_id] = {
-            "status": "failed",
-            "message": f"Error running {script_path}: {str(e)}",
-            "progress": "Failed"
+        summary = label.format(done=done, total=total if total is not None else "?")
+        details = {
+            "stage": stage,
+            "done": done,
+            "total": total,
+            "percent": round(percent, 1),
+            "elapsed_s": round(elapsed, 1),
+            "eta_s": eta_s
         }
+        job_store.update(
+            self.task_id,
+            progress=f"{int(percent)}% - {summary}",
+            details=json.dumps(details)
+        )
 
-def process_pdf_pipeline(temp_pdf_path: str, task_id: str):
-    """Process PDF through ingestion and embedding pipeline"""
+def process_pdf_pipeline(job, converter, engine):
+    """Process one uploaded PDF through ingestion and embedding
+    
+    Only this document is converted, chunked and embedded, using the
+    worker's already loaded converter and embedding engine. Raises on
+    failure so the worker can decide whether to retry.
+    """
+    import ingest_pdfs
+    import embed_chunks
+    
+    task_id = job["task_id"]
+    progress = JobProgress(task_id)
+    
+    # Step 1: Extract and chunk
+    job_store.update(task_id, message="Extracting and chunking PDF content...")
+    
     try:
-        processing_status[task_id] = {
-            "status": "processing",
-            "message": "Starting PDF processing pipeline...",
-            "progress": "0%"
-        }
-        
-        # Create data/pdfs directory if it doesn't exist
-        project_root = Path(__file__).parent.parent
-        pdf_dir = project_root / "data" / "pdfs"
-        pdf_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Copy temp file to data/pdfs directory
-        filename = Path(temp_pdf_path).name
-        destination = pdf_dir / filename
-        shutil.copy2(temp_pdf_path, destination)
-        
-        processing_status[task_id]["progress"] = "10% - PDF copied to processing directory"
-        
-        # Step 1: Run ingest_pdfs.py
-        processing_status[task_id]["message"] = "Extracting and chunking PDF content..."
-        processing_status[task_id]["progress"] = "20% - Starting text extraction"
-        
-        project_root = Path(__file__).parent.parent
-        ingest_script = project_root / "scripts" / "ingest_pdfs.py"
-        
-        result = subprocess.run(
-            [sys.executable, str(ingest_script)],
-            capture_output=True,
-            text=True,
-            cwd=str(project_root)
+        doc_id = ingest_pdfs.ingest_document(
+            job["file_path"], job["source_name"], converter=converter,
+            pages_per_task=UPLOAD_PAGES_PER_STEP, progress=progress
         )
+    except Exception as e:
+        raise Exception(f"PDF ingestion failed: {e}")
+    
+    # Step 2: Compute embeddings for this document's chunks
+    job_store.update(task_id, message="Computing embeddings for chunks...")
+    
+    try:
+        embed_chunks.embed_document(doc_id, engine, page_size=UPLOAD_EMBED_STEP, progress=progress)
+    except Exception as e:
+        raise Exception(f"Embedding computation failed: {e}")
+
+def remove_upload(file_path):
+    try:
+        os.remove(file_path)
+    except OSError:
+        pass  # Ignore cleanup errors
+
+class IngestionWorkerPool:
+    """Fixed number of long-lived workers pulling jobs from the durable queue
+    
+    The embedding engine is loaded once and shared (it runs one encode at a
+    time); each worker thread keeps its own Docling converter. The pool size bounds how many uploads are
+    converted at the same time, however many arrive.
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS):
+        self.workers = max(1, workers)
+        self.threads = []
+        self.engine = None
+        self.engine_lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.models_ready = threading.Event()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def start(self, preload=INGEST_PRELOAD_MODELS):
+        self.stopping.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, args=(preload,), name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout=30)
+        self.threads = []
+        if self.engine:
+            self.engine.close()
+            self.engine = None
+
+    def notify(self):
+        """Wake idle workers after a job is enqueued"""
+        self.wakeup.set()
+
+    def _get_engine(self):
+        import embed_chunks
         
-        if result.returncode != 0:
-            raise Exception(f"PDF ingestion failed: {result.stderr}")
-        
-        processing_status[task_id]["progress"] = "60% - Text extraction completed"
-        
-        # Step 2: Run embed_chunks.py
-        processing_status[task_id]["message"] = "Computing embeddings for chunks..."
-        processing_status[task_id]["progress"] = "70% - Starting embedding computation"
-        
-        embed_script = project_root / "scripts" / "embed_chunks.py"
-        
-        result = subprocess.run(
-            [sys.executable, str(embed_script)],
-            capture_output=True,
-            text=True,
-            cwd=str(project_root)
-        )
-        
-        if result.returncode != 0:
-            raise Exception(f"Embedding computation failed: {result.stderr}")
-        
-        # Clean up - remove the PDF file from data/pdfs
+        with self.engine_lock:
+            if self.engine is None:
+                print("Loading embedding model...")
+                self.engine = embed_chunks.EmbeddingEngine()
+                print("Embedding model loaded!")
+            return self.engine
+
+    def _maintain_index(self):
+        """Build or resize the ANN indexes if they are missing or stale
+
+        compute_embeddings does this after bulk loads, but an upload only
+        embeds its own document, so without it a corpus loaded through
+        /upload never gets an IVFFlat index or has its lists resized.
+        """
+        if not self.index_lock.acquire(blocking=False):
+            return  # Another worker is already checking
         try:
-            os.remove(destination)
-            os.remove(temp_pdf_path)
-        except:
-            pass  # Ignore cleanup errors
-        
-        processing_status[task_id] = {
-            "status": "completed",
-            "message": "PDF processing completed successfully! You can now query the document.",
-            "progress": "100%"
-        }
+            import embed_chunks
+            import manage_index
+            
+            conn = embed_chunks.get_db_connection()
+            try:
+                manage_index.ensure_index(conn)
+            finally:
+                conn.close()
+        except Exception as e:
+            # Searches still work (more slowly) without a fresh index
+            print(f"Index maintenance warning: {e}")
+        finally:
+            self.index_lock.release()
+
+    def _load_converter(self):
+        import ingest_pdfs
         
-    except Exception as e:
-        processing_status[task_id] = {
-            "status": "failed",
-            "message": f"Pipeline failed: {str(e)}",
-            "progress": "Failed"
-        }
+        converter = ingest_pdfs.create_converter()
+        if converter is None:
+            raise RuntimeError("Failed to initialize the Docling converter")
+        return converter
+
+    def _run(self, preload):
+        converter = None
+        if preload:
+            try:
+                converter = self._load_converter()
+                self._get_engine()
+                self.models_ready.set()
+            except Exception as e:
+                print(f"Model preload failed, retrying on first job: {e}")
         
-        # Clean up on failure
-        try:
-            if 'destination' in locals():
-                os.remove(destination)
-            os.remove(temp_pdf_path)
-        except:
-            pass
+        while not self.stopping.is_set():
+            job = job_store.claim()
+            if job is None:
+                # Poll as well, so jobs waiting on retry backoff get picked up
+                self.wakeup.wait(timeout=1.0)
+                self.wakeup.clear()
+                continue
+            
+            try:
+                if converter is None:
+                    job_store.update(job["task_id"], message="Loading ingestion models...")
+                    converter = self._load_converter()
+                engine = self._get_engine()
+                self.models_ready.set()
+                
+                process_pdf_pipeline(job, converter, engine)
+                
+                remove_upload(job["file_path"])
+                invalidate_answer_cache()
+                job_store.complete(
+                    job["task_id"],
+                    "PDF processing completed successfully! You can now query the document."
+                )
+                self._maintain_index()
+            except Exception as e:
+                print(f"Job {job['task_id']} failed (attempt {job['attempts']}): {e}")
+                if not job_store.fail(job, str(e)):
+                    remove_upload(job["file_path"])
+
+ingestion_workers = IngestionWorkerPool()
 
 @app.get("/")
 async def root():
     return {"message": "RAG Upload API is running"}
 
 @app.post("/upload", response_model=UploadResponse)
-async def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(file: UploadFile = File(...), priority: int = 0):
     # Validate file type
     if not file.filename or not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
@@ -180,13 +315,16 @@ async def upload_pdf(file: UploadFile = File(...)):
     file_size = 0
     
     try:
-        # Create a temporary file with original filename
-        temp_dir = tempfile.gettempdir()
+        # Generate task ID
+        task_id = f"task_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+        
+        # Keep the upload on durable storage until its job finishes
+        UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         # Clean filename to avoid path issues
         safe_filename = "".join(c for c in file.filename if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-        temp_file_path = os.path.join(temp_dir, f"upload_{int(time.time())}_{safe_filename}")
+        upload_path = str(UPLOAD_DIR / f"{task_id}.pdf")
         
-        with open(temp_file_path, 'wb') as temp_file:
+        with open(upload_path, 'wb') as upload_file:
             # Read and write file in chunks to check size
             while True:
                 chunk = await file.read(8192)  # 8KB chunks
@@ -194,27 +332,21 @@ async def upload_pdf(file: UploadFile = File(...)):
                     break
                 file_size += len(chunk)
                 if file_size > max_size:
-                    os.unlink(temp_file_path)
+                    upload_file.close()
+                    os.unlink(upload_path)
                     raise HTTPException(status_code=413, detail="File too large. Maximum size is 50MB")
-                temp_file.write(chunk)
+                upload_file.write(chunk)
         
-        # Generate task ID
-        task_id = f"task_{int(time.time())}_{file.filename}"
-        
-        # Start processing in background thread
-        thread = threading.Thread(
-            target=process_pdf_pipeline,
-            args=(temp_file_path, task_id)
-        )
-        thread.daemon = True
-        thread.start()
+        # Queue for the ingestion workers
+        await run_in_threadpool(job_store.enqueue, task_id, safe_filename, upload_path, priority=priority)
+        ingestion_workers.notify()
         
         return UploadResponse(
             success=True,
-            message=f"PDF upload successful. Processing started for {file.filename}",
+            message=f"PDF upload successful. Processing queued for {file.filename}",
             task_id=task_id
         )
-        
+    
     except HTTPException:
         raise
     except Exception as e:
@@ -222,21 +354,65 @@ async def upload_pdf(file: UploadFile = File(...)):
 
 @app.get("/status/{task_id}", response_model=StatusResponse)
 async def get_status(task_id: str):
-    if task_id not in processing_status:
+    job = await run_in_threadpool(job_store.get, task_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    status_info = processing_status[task_id]
+    event = job_event(job)
     return StatusResponse(
         task_id=task_id,
-        status=status_info["status"],
-        message=status_info["message"],
-        progress=status_info.get("progress")
+        status=event["status"],
+        message=event["message"],
+        progress=event["progress"],
+        attempts=event["attempts"],
+        details=event["details"]
+    )
+
+@app.get("/events")
+async def job_events(request: Request, since: float = 0.0):
+    """Server-Sent Events stream of job updates
+    
+    One connection covers every job: it first replays jobs changed after
+    `since` (default: the last hour), then pushes each change as it happens.
+    """
+    async def events():
+        last_seen = since or (time.time() - 3600)
+        last_version = -1
+        last_sent = time.time()
+        sent = {}  # task_id -> updated_at of the last event sent
+        while not await request.is_disconnected():
+            if job_store.version != last_version:
+                last_version = job_store.version
+                # Look back a little: concurrent writers may commit slightly out of order
+                jobs = await run_in_threadpool(job_store.changed_since, last_seen - 2.0)
+                for job in jobs:
+                    if sent.get(job["task_id"], -1.0) >= job["updated_at"]:
+                        continue
+                    sent[job["task_id"]] = job["updated_at"]
+                    last_seen = max(last_seen, job["updated_at"])
+                    yield f"data: {json.dumps(job_event(job))}\n\n"
+                    last_sent = time.time()
+            if time.time() - last_sent > EVENTS_KEEPALIVE_S:
+                yield ": keep-alive\n\n"
+                last_sent = time.time()
+            await asyncio.sleep(EVENTS_POLL_S)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "RAG Upload API"}
+    return {
+        "status": "healthy",
+        "service": "RAG Upload API",
+        "models_loaded": ingestion_workers.models_ready.is_set(),
+        "workers": ingestion_workers.workers,
+        "jobs": await run_in_threadpool(job_store.counts)
+    }
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8004)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8004)
@@ -0,0 +1,189 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+class JobStore:
+    """SQLite-backed upload job queue that survives restarts
+    
+    Jobs are claimed by priority (higher first), then age. A failed job is
+    retried with exponential backoff until it runs out of attempts.
+    """
+
+    def __init__(self, path, max_attempts=3, retry_backoff_s=30.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.retry_backoff_s = retry_backoff_s
+        # Bumped on every write so event streams only query when something changed
+        self.version = 0
+        self.version_lock = threading.Lock()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    task_id       TEXT PRIMARY KEY,
+                    source_name   TEXT NOT NULL,
+                    file_path     TEXT NOT NULL,
+                    status        TEXT NOT NULL,
+                    message       TEXT NOT NULL,
+                    progress      TEXT,
+                    details       TEXT,
+                    priority      INTEGER NOT NULL DEFAULT 0,
+                    attempts      INTEGER NOT NULL DEFAULT 0,
+                    max_attempts  INTEGER NOT NULL,
+                    next_run_at   REAL NOT NULL,
+                    created_at    REAL NOT NULL,
+                    updated_at    REAL NOT NULL
+                );
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_jobs_runnable
+                ON jobs (status, priority DESC, created_at);
+            """)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs);")}
+            if "details" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN details TEXT;")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs (updated_at);")
+
+    def touch(self):
+        with self.version_lock:
+            self.version += 1
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, task_id, source_name, file_path, priority=0, max_attempts=None):
+        if max_attempts is None:
+            max_attempts = self.max_attempts
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (task_id, source_name, file_path, status, message, progress,
+                                  priority, attempts, max_attempts, next_run_at, created_at, updated_at)
+                VALUES (?, ?, ?, 'queued', 'Queued for processing...', 'Queued', ?, 0, ?, ?, ?, ?);
+                """,
+                (task_id, source_name, file_path, priority, max_attempts, now, now, now)
+            )
+        self.touch()
+
+    def claim(self):
+        """Atomically take the next runnable job, or return None"""
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE status IN ('queued', 'retrying') AND next_run_at <= ?
+                  AND attempts < max_attempts
+                ORDER BY priority DESC, created_at
+                LIMIT 1;
+                """,
+                (now,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT;")
+                return None
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'processing', attempts = attempts + 1,
+                                message = 'Starting PDF processing pipeline...', progress = '0%',
+                                updated_at = ?
+                WHERE task_id = ?;
+                """,
+                (now, row["task_id"])
+            )
+            conn.execute("COMMIT;")
+            self.touch()
+            job = dict(row)
+            job["attempts"] += 1
+            return job
+
+    def update(self, task_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self.connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE task_id = ?;",
+                (*fields.values(), task_id)
+            )
+        self.touch()
+
+    def complete(self, task_id, message):
+        self.update(task_id, status="completed", message=message, progress="100%",
+                    details=json.dumps({"percent": 100, "eta_s": 0}))
+
+    def fail(self, job, error):
+        """Schedule a retry with backoff, or mark the job failed for good; returns True if retrying"""
+        if job["attempts"] < job["max_attempts"]:
+            delay = self.retry_backoff_s * (2 ** (job["attempts"] - 1))
+            self.update(
+                job["task_id"],
+                status="retrying",
+                message=f"Attempt {job['attempts']} failed, retrying in {int(delay)}s: {error}",
+                progress="Retrying",
+                next_run_at=time.time() + delay
+            )
+            return True
+        self.update(job["task_id"], status="failed", message=f"Pipeline failed: {error}", progress="Failed")
+        return False
+
+    def recover(self):
+        """Re-queue jobs that were running when the service stopped
+
+        A job that already used all its attempts is failed instead, so a PDF
+        that crashes the process is not retried forever across restarts.
+        Returns (re-queued count, file paths of the jobs failed here).
+        """
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE;")
+            exhausted = conn.execute(
+                "SELECT file_path FROM jobs WHERE status = 'processing' AND attempts >= max_attempts;"
+            ).fetchall()
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'failed', progress = 'Failed', updated_at = ?,
+                                message = 'Pipeline failed: the service stopped during the last attempt'
+                WHERE status = 'processing' AND attempts >= max_attempts;
+                """,
+                (now,)
+            )
+            cursor = conn.execute(
+                """
+                UPDATE jobs SET status = 'queued', message = 'Re-queued after restart', updated_at = ?
+                WHERE status = 'processing';
+                """,
+                (now,)
+            )
+            conn.execute("COMMIT;")
+        self.touch()
+        return cursor.rowcount, [row["file_path"] for row in exhausted]
+
+    def changed_since(self, since):
+        """Jobs updated after the given timestamp, oldest change first"""
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE updated_at > ? ORDER BY updated_at;", (since,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def get(self, task_id):
+        with self.connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE task_id = ?;", (task_id,)).fetchone()
+            return dict(row) if row else None
+
+    def counts(self):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status;").fetchall()
+            return {status: count for status, count in rows}
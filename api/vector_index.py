@@ -0,0 +1,360 @@
+import numpy as np
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+class MemoryVectorIndex:
+    """Exact dot-product top-k over every chunk embedding, held in this process
+
+    Embeddings are unit vectors, so the dot product ranks like cosine, and
+    like L2 and inner product too. The bulk of the rows lives in a memory-mapped
+    snapshot (float32, or int8 with a scale per row); rows embedded since are kept in
+    a small in-RAM delta and folded into the next snapshot. Each snapshot is
+    written to its own directory and current.json is switched to it last, so
+    a crash leaves the previous snapshot in use. Every sync also hides
+    chunks deleted from Postgres; callers drop ids deleted since the last
+    sync, which they can no longer fetch.
+    """
+
+    def __init__(self, path, dtype="float32", dim=768, type_codes=None, lookback_s=300,
+                 snapshot_rows=10000, block_rows=8192, fetch_rows=5000):
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"MEMORY_INDEX_DTYPE must be float32 or int8, got {dtype!r}")
+        self.path = Path(path)
+        self.dtype = dtype
+        self.dim = dim
+        self.type_codes = type_codes or {"text": 0}  # chunk_type -> code, unknown types count as text
+        self.lookback_s = lookback_s
+        self.snapshot_rows = snapshot_rows
+        self.block_rows = block_rows
+        self.fetch_rows = fetch_rows
+        self.ready = False
+        self.snapshot = None       # directory name of the mapped snapshot
+        self.watermark = None      # embedded_at of the newest row seen
+        self.lock = threading.Lock()
+        self._set_base(np.empty((0, self.dim), dtype=np.float32), None,
+                       np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int8))
+        self.delta = {}            # chunk_id -> (float32 vector, type code)
+        self.delta_arrays = self._pack_delta({})
+
+    def _current(self):
+        """Name of the snapshot current.json points to, or None"""
+        try:
+            return json.loads((self.path / "current.json").read_text())["snapshot"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _set_base(self, vectors, scales, ids, types):
+        self.base_vectors = vectors
+        self.base_scales = scales
+        self.base_ids = ids
+        self.base_types = types
+        self.base_alive = np.ones(len(ids), dtype=bool)
+        self.positions = {int(chunk_id): row for row, chunk_id in enumerate(ids)}
+
+    def _pack_delta(self, delta):
+        ids = np.fromiter(delta.keys(), dtype=np.int64, count=len(delta))
+        if not delta:
+            return np.empty((0, self.dim), dtype=np.float32), None, ids, np.empty(0, dtype=np.int8)
+        vectors = np.stack([vector for vector, _ in delta.values()])
+        types = np.fromiter((code for _, code in delta.values()), dtype=np.int8, count=len(delta))
+        return vectors, None, ids, types
+
+    def load(self):
+        """Memory-map the last snapshot; returns False if there is no usable one"""
+        name = self._current()
+        if name is None:
+            return False
+        directory = self.path / name
+        try:
+            meta = json.loads((directory / "meta.json").read_text())
+            if meta.get("dtype") != self.dtype or meta.get("dim") != self.dim:
+                print(f"Vector index snapshot is {meta.get('dtype')}/{meta.get('dim')}, rebuilding")
+                return False
+            vectors = np.load(directory / "vectors.npy", mmap_mode="r")
+            scales = np.load(directory / "scales.npy") if self.dtype == "int8" else None
+            ids = np.load(directory / "ids.npy")
+            types = np.load(directory / "types.npy")
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Vector index snapshot {name} is unreadable ({e}), rebuilding")
+            return False
+        counts = {len(ids), len(types), vectors.shape[0], meta.get("rows")}
+        if scales is not None:
+            counts.add(len(scales))
+        if len(counts) != 1 or vectors.shape[1:] != (self.dim,):
+            print(f"Vector index snapshot {name} files do not match ({sorted(map(str, counts))} rows), rebuilding")
+            return False
+        with self.lock:
+            self._set_base(vectors, scales, ids, types)
+            self.delta = {}
+            self.delta_arrays = self._pack_delta({})
+            self.watermark = meta["watermark"]
+            self.snapshot = name
+            self.ready = True
+        print(f"Vector index snapshot loaded: {len(ids)} rows ({self.dtype})")
+        return True
+
+    def _type_code(self, chunk_type):
+        return self.type_codes.get(chunk_type, self.type_codes["text"])
+
+    @staticmethod
+    def _quantize(vectors):
+        """Symmetric per-row int8 quantization; returns (int8 vectors, float32 scales)"""
+        if not len(vectors):
+            return vectors.astype(np.int8), np.empty(0, dtype=np.float32)
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+
+    def sync(self, connect):
+        """Pull embeddings written since the last sync (all of them the first time)
+
+        connect() is a context manager yielding a Postgres connection; the
+        transaction is left to it to end. Returns (rows added, rows removed).
+        """
+        with connect() as conn:
+            with conn.cursor() as cur:
+                # The row count and the rows of a full load come from one snapshot.
+                # A full load is paged through a cursor and may outlast the per-query timeout.
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ; SET LOCAL statement_timeout = 0;")
+            # ready: a snapshot was mapped or every row has been read once
+            if not self.ready:
+                added = self._load_all(conn)
+                removed = 0
+                if added:
+                    self.save()
+            else:
+                added = self._load_changes(conn)
+                removed = self._drop_deleted(conn)
+                # Replaced and deleted snapshot rows are only dropped from disk by a new snapshot
+                changed = len(self.delta) + int((~self.base_alive).sum())
+                if changed >= self.snapshot_rows or (changed and self.snapshot is None):
+                    self.save()
+        
+        self.ready = True
+        return added, removed
+
+    def _load_all(self, conn):
+        """Read every embedding straight into the arrays of a new base"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NOT NULL;")
+            count = cur.fetchone()[0]
+        int8 = self.dtype == "int8"
+        vectors = np.empty((count, self.dim), dtype=np.int8 if int8 else np.float32)
+        scales = np.empty(count, dtype=np.float32) if int8 else None
+        ids = np.empty(count, dtype=np.int64)
+        types = np.empty(count, dtype=np.int8)
+        watermark = None
+        filled = 0
+        with conn.cursor(name="vector_index_sync") as cur:
+            cur.itersize = self.fetch_rows
+            cur.execute("""
+                SELECT chunk_id, embedding::real[], chunk_type, embedded_at
+                FROM doc_chunks WHERE embedding IS NOT NULL;
+            """)
+            while True:
+                rows = cur.fetchmany(self.fetch_rows)[:count - filled]
+                if not rows:
+                    break
+                end = filled + len(rows)
+                page = np.array([row[1] for row in rows], dtype=np.float32)
+                if int8:
+                    vectors[filled:end], scales[filled:end] = self._quantize(page)
+                else:
+                    vectors[filled:end] = page
+                ids[filled:end] = [row[0] for row in rows]
+                types[filled:end] = [self._type_code(row[2]) for row in rows]
+                stamps = [row[3].isoformat() for row in rows if row[3] is not None]
+                if stamps:
+                    watermark = max([watermark, *stamps]) if watermark else max(stamps)
+                filled = end
+        
+        with self.lock:
+            self._set_base(vectors[:filled], None if scales is None else scales[:filled],
+                           ids[:filled], types[:filled])
+            self.delta = {}
+            self.delta_arrays = self._pack_delta({})
+            self.watermark = watermark
+        return filled
+
+    def _load_changes(self, conn):
+        """Read rows embedded since the watermark and publish them as one delta update"""
+        pending = {}     # chunk_id -> (float32 vector, type code)
+        replaced = []    # base rows superseded by a new embedding
+        watermark = self.watermark
+        with conn.cursor(name="vector_index_sync") as cur:
+            cur.itersize = self.fetch_rows
+            # With no watermark yet (no row had embedded_at), every stamped row is new
+            cur.execute("""
+                SELECT chunk_id, embedding::real[], chunk_type, embedded_at
+                FROM doc_chunks
+                WHERE embedding IS NOT NULL
+                  AND embedded_at > COALESCE(%s::timestamp - make_interval(secs => %s), '-infinity');
+            """, (self.watermark, self.lookback_s))
+            while True:
+                rows = cur.fetchmany(self.fetch_rows)
+                if not rows:
+                    break
+                for chunk_id, embedding, chunk_type, embedded_at in rows:
+                    vector = np.asarray(embedding, dtype=np.float32)
+                    position = self.positions.get(chunk_id)
+                    if position is not None and self.base_alive[position]:
+                        if self._base_matches(position, vector):
+                            continue  # re-read by the lookback, unchanged
+                        replaced.append(position)
+                    elif chunk_id in self.delta and np.array_equal(self.delta[chunk_id][0], vector):
+                        continue
+                    pending[chunk_id] = (vector, self._type_code(chunk_type))
+                    if embedded_at is not None:
+                        stamp = embedded_at.isoformat()
+                        if watermark is None or stamp > watermark:
+                            watermark = stamp
+        
+        if pending:
+            delta = {**self.delta, **pending}
+            delta_arrays = self._pack_delta(delta)
+            with self.lock:
+                self.base_alive[replaced] = False
+                self.delta = delta
+                self.delta_arrays = delta_arrays
+                self.watermark = watermark
+        return len(pending)
+
+    def _drop_deleted(self, conn):
+        """Hide rows whose chunk was deleted or lost its embedding; returns how many"""
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NOT NULL;")
+            live_count = cur.fetchone()[0]
+            # Every live chunk is in the index after the sync, so equal counts mean nothing was deleted
+            if live_count == int(self.base_alive.sum()) + len(self.delta):
+                return 0
+            cur.execute("SELECT chunk_id FROM doc_chunks WHERE embedding IS NOT NULL;")
+            live_ids = np.array([row[0] for row in cur.fetchall()], dtype=np.int64)
+        
+        dead = np.flatnonzero(self.base_alive & ~np.isin(self.base_ids, live_ids))
+        delta_ids = self.delta_arrays[2]
+        gone = set(delta_ids[~np.isin(delta_ids, live_ids)].tolist())
+        if not len(dead) and not gone:
+            return 0
+        delta = {chunk_id: entry for chunk_id, entry in self.delta.items() if chunk_id not in gone}
+        delta_arrays = self._pack_delta(delta) if gone else self.delta_arrays
+        with self.lock:
+            self.base_alive[dead] = False
+            self.delta = delta
+            self.delta_arrays = delta_arrays
+        return len(dead) + len(gone)
+
+    def _base_matches(self, position, vector):
+        stored = np.asarray(self.base_vectors[position], dtype=np.float32)
+        if self.base_scales is not None:
+            stored = stored * self.base_scales[position]
+            return np.allclose(stored, vector, atol=float(self.base_scales[position]))
+        return np.array_equal(stored, vector)
+
+    def save(self):
+        """Write the live base rows and the delta as a new snapshot and map it"""
+        with self.lock:
+            keep = self.base_alive.copy()
+            base = (self.base_vectors, self.base_scales, self.base_ids, self.base_types)
+            delta_vectors, _, delta_ids, delta_types = self.delta_arrays
+        
+        if keep.all() and not len(delta_ids):
+            # Nothing to compact (a full load): write the base as it is
+            vectors, scales, ids, types = base
+        else:
+            # Snapshot rows stay in their stored form; only the delta is encoded
+            delta_scales = None
+            if self.dtype == "int8":
+                delta_vectors, delta_scales = self._quantize(delta_vectors)
+            vectors = np.concatenate([base[0][keep], delta_vectors])
+            scales = np.concatenate([base[1][keep], delta_scales]) if self.dtype == "int8" else None
+            ids = np.concatenate([base[2][keep], delta_ids])
+            types = np.concatenate([base[3][keep], delta_types])
+        
+        # A new directory per snapshot; files of the mapped one are never overwritten
+        self.path.mkdir(parents=True, exist_ok=True)
+        versions = [int(entry.name.split("-")[1]) for entry in self.path.glob("snapshot-*")
+                    if entry.name.split("-")[1].isdigit()]
+        name = f"snapshot-{max(versions, default=0) + 1:06d}"
+        directory = self.path / name
+        directory.mkdir()
+        np.save(directory / "vectors.npy", vectors)
+        np.save(directory / "ids.npy", ids)
+        np.save(directory / "types.npy", types)
+        if self.dtype == "int8":
+            np.save(directory / "scales.npy", scales)
+        (directory / "meta.json").write_text(json.dumps({
+            "dtype": self.dtype, "dim": self.dim, "rows": int(len(ids)), "watermark": self.watermark
+        }))
+        # Switch to the new snapshot in one step
+        pointer = self.path / "current.json.tmp"
+        pointer.write_text(json.dumps({"snapshot": name}))
+        os.replace(pointer, self.path / "current.json")
+        
+        mapped = np.load(directory / "vectors.npy", mmap_mode="r")
+        mapped_scales = np.load(directory / "scales.npy") if self.dtype == "int8" else None
+        with self.lock:
+            # Rows synced while the snapshot was written stay in the delta
+            written = set(int(chunk_id) for chunk_id in delta_ids)
+            delta = {chunk_id: entry for chunk_id, entry in self.delta.items() if chunk_id not in written}
+            self._set_base(mapped, mapped_scales, ids, types)
+            for chunk_id in delta:
+                if chunk_id in self.positions:
+                    self.base_alive[self.positions[chunk_id]] = False
+            self.delta = delta
+            self.delta_arrays = self._pack_delta(delta)
+            self.snapshot = name
+        # Older snapshots and leftovers of interrupted saves; one still mapped
+        # by a running search (Windows) is removed by a later save
+        for entry in self.path.glob("snapshot-*"):
+            if entry.name != name:
+                shutil.rmtree(entry, ignore_errors=True)
+        print(f"Vector index snapshot written: {len(ids)} rows ({self.dtype})")
+
+    def search(self, query, k, type_code=None):
+        """Return the chunk ids of the k best rows (optionally of one chunk type), best first"""
+        query = np.asarray(query, dtype=np.float32)
+        with self.lock:
+            parts = [
+                (self.base_vectors, self.base_scales, self.base_ids, self.base_types, self.base_alive),
+                (*self.delta_arrays, None)
+            ]
+        
+        found_ids = []
+        found_scores = []
+        for vectors, scales, ids, types, alive in parts:
+            for start in range(0, len(ids), self.block_rows):
+                end = min(start + self.block_rows, len(ids))
+                scores = np.asarray(vectors[start:end], dtype=np.float32) @ query
+                if scales is not None:
+                    scores *= scales[start:end]
+                mask = None if alive is None else alive[start:end]
+                if type_code is not None:
+                    type_mask = types[start:end] == type_code
+                    mask = type_mask if mask is None else mask & type_mask
+                if mask is not None:
+                    scores = np.where(mask, scores, -np.inf)
+                top = min(k, len(scores))
+                best = np.argpartition(-scores, top - 1)[:top]
+                best = best[np.isfinite(scores[best])]
+                found_ids.append(ids[start:end][best])
+                found_scores.append(scores[best])
+        
+        if not found_ids:
+            return []
+        all_ids = np.concatenate(found_ids)
+        all_scores = np.concatenate(found_scores)
+        order = np.argsort(-all_scores)[:k]
+        return [int(chunk_id) for chunk_id in all_ids[order]]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": True,
+                "ready": self.ready,
+                "dtype": self.dtype,
+                "snapshot_rows": int(self.base_alive.sum()),
+                "delta_rows": len(self.delta),
+                "watermark": self.watermark
+            }
@@ -75,7 +75,8 @@ class RAGChatbot {
     }
     
     // Update addMessage method to use markdown
-    addMessage(content, type, sources = [], runtime = null) {
+    // Pass save = false for a streaming bot message that is completed later
+    addMessage(content, type, sources = [], runtime = null, save = true) {
         this.messageCount++;
         
         const messageDiv = document.createElement('div');
@@ -111,28 +112,8 @@ class RAGChatbot {
         messageContent.appendChild(messageBubble);
         
         // Add metadata for bot messages
-        if (type === 'bot') {
-            const messageMeta = document.createElement('div');
-            messageMeta.className = 'message-meta';
-            
-            if (sources && sources.length > 0) {
-                const sourcesDiv = document.createElement('div');
-                sourcesDiv.className = 'sources';
-                sourcesDiv.innerHTML = `
-                    <div class="sources-title">Sources:</div>
-                    <div class="sources-list">${sources.join(', ')}</div>
-                `;
-                messageMeta.appendChild(sourcesDiv);
-            }
-            
-            if (runtime) {
-                const runtimeDiv = document.createElement('div');
-                runtimeDiv.className = 'runtime';
-                runtimeDiv.textContent = `Response time: ${runtime}ms`;
-                messageMeta.appendChild(runtimeDiv);
-            }
-            
-            messageContent.appendChild(messageMeta);
+        if (type === 'bot' && save) {
+            this.appendMessageMeta(messageContent, sources, runtime);
         }
         
         messageDiv.appendChild(avatar);
@@ -142,6 +123,38 @@ class RAGChatbot {
         this.scrollToBottom();
         
         // Save message to current chat
+        if (save) {
+            this.saveMessage(content, type, sources, runtime);
+        }
+        
+        return { messageContent, messageBubble };
+    }
+    
+    appendMessageMeta(messageContent, sources = [], runtime = null) {
+        const messageMeta = document.createElement('div');
+        messageMeta.className = 'message-meta';
+        
+        if (sources && sources.length > 0) {
+            const sourcesDiv = document.createElement('div');
+            sourcesDiv.className = 'sources';
+            sourcesDiv.innerHTML = `
+                <div class="sources-title">Sources:</div>
+                <div class="sources-list">${sources.join(', ')}</div>
+            `;
+            messageMeta.appendChild(sourcesDiv);
+        }
+        
+        if (runtime) {
+            const runtimeDiv = document.createElement('div');
+            runtimeDiv.className = 'runtime';
+            runtimeDiv.textContent = `Response time: ${runtime}ms`;
+            messageMeta.appendChild(runtimeDiv);
+        }
+        
+        messageContent.appendChild(messageMeta);
+    }
+    
+    saveMessage(content, type, sources = [], runtime = null) {
         if (this.currentChatId) {
             this.currentChatMessages.push({
                 content: content,
@@ -288,8 +301,7 @@ class RAGChatbot {
         this.setLoading(true);
         
         try {
-            const response = await this.queryRAG(question);
-            this.addMessage(response.answer, 'bot', response.sources, response.runtime_ms);
+            await this.streamRAG(question);
         } catch (error) {
             this.addErrorMessage('Sorry, something went wrong. Please try again.');
             console.error('Error:', error);
@@ -299,23 +311,71 @@ class RAGChatbot {
         }
     }
     
-    async queryRAG(question) {
+    // Stream the answer over Server-Sent Events and render it as tokens arrive
+    async streamRAG(question) {
         const response = await fetch(`${this.apiUrl}/query`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
             },
             body: JSON.stringify({
                 question: question,
-                num_chunks: 10
+                num_chunks: 10,
+                stream: true
             })
         });
         
-        if (!response.ok) {
+        if (!response.ok || !response.body) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         
-        return await response.json();
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let message = null;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // SSE frames are separated by a blank line
+            const frames = buffer.split('\n\n');
+            buffer = frames.pop();
+            
+            for (const frame of frames) {
+                const line = frame.split('\n').find(l => l.startsWith('data:'));
+                if (!line) continue;
+                const event = JSON.parse(line.slice(5).trim());
+                
+                if (event.type === 'error') {
+                    throw new Error(event.detail);
+                }
+                
+                if (!message) {
+                    // First event: swap the spinner for the message being written
+                    this.loadingOverlay.classList.add('hidden');
+                    message = this.addMessage('', 'bot', [], null, false);
+                }
+                
+                if (event.type === 'token') {
+                    answer += event.content;
+                    const markdownContent = message.messageBubble.querySelector('.markdown-content');
+                    markdownContent.innerHTML = this.processMarkdown(answer);
+                    message.messageBubble.className = `message-bubble ${this.getBubbleSizeClass(answer)}`;
+                    this.scrollToBottom();
+                } else if (event.type === 'done') {
+                    this.appendMessageMeta(message.messageContent, event.sources, event.runtime_ms);
+                    this.saveMessage(answer, 'bot', event.sources, event.runtime_ms);
+                    this.scrollToBottom();
+                    return;
+                }
+            }
+        }
+        
+        throw new Error('Stream ended before the answer was complete');
     }
     
     // Determine bubble size class based on content length
@@ -3,7 +3,14 @@ from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
 import os
 import gc
+import io
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import torch
+from manage_index import ensure_index
 
 # Load environment variables
 load_dotenv()
@@ -19,112 +26,348 @@ def get_db_connection():
     }
     return psycopg2.connect(**conn_params)
 
-def compute_embeddings():
-    """Compute embeddings for all chunks without embeddings"""
-    print("Loading embedding model...")
+MODEL_NAME = "Alibaba-NLP/gte-multilingual-base"
+EMBEDDING_DIM = 768
+
+# Batches are sized by padded tokens (longest text x batch size), not by count
+EMBED_TOKEN_BUDGET = int(os.getenv("EMBED_TOKEN_BUDGET", "16384"))
+# Not EMBED_MAX_BATCH: that one sizes query micro-batches in api/app_retrieve.py
+INGEST_EMBED_MAX_BATCH = int(os.getenv("INGEST_EMBED_MAX_BATCH", "64"))
+EMBED_MAX_SEQ_LENGTH = int(os.getenv("EMBED_MAX_SEQ_LENGTH", "8192"))
+# Encoder processes on CPU; 1 keeps everything in this process
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+# Rows fetched per round-trip from the server-side cursor, and pages buffered ahead
+FETCH_PAGE_SIZE = int(os.getenv("EMBED_FETCH_PAGE_SIZE", "512"))
+PREFETCH_PAGES = int(os.getenv("EMBED_PREFETCH_PAGES", "2"))
+
+def iter_pending_chunks(conn, page_size=FETCH_PAGE_SIZE):
+    """Yield pages of (chunk_id, chunk_text) rows without embeddings
+
+    Uses a named (server-side) cursor, so only one page is held in memory
+    no matter how many chunks are pending.
+    """
+    with conn.cursor(name="pending_chunks") as cur:
+        cur.itersize = page_size
+        cur.execute("SELECT chunk_id, chunk_text FROM doc_chunks WHERE embedding IS NULL ORDER BY chunk_id;")
+        while True:
+            rows = cur.fetchmany(page_size)
+            if not rows:
+                break
+            yield rows
+
+def prefetch(pages, depth=PREFETCH_PAGES):
+    """Run a page generator on a background thread so DB fetches overlap encoding"""
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+    
+    def producer():
+        try:
+            for page in pages:
+                while not stop.is_set():
+                    try:
+                        buffer.put(page, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put(done)
+        except Exception as e:
+            buffer.put(e)
+    
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join(timeout=5)
+
+def load_model(device):
+    model = SentenceTransformer(MODEL_NAME, trust_remote_code=True)
+    model.max_seq_length = min(model.max_seq_length or EMBED_MAX_SEQ_LENGTH, EMBED_MAX_SEQ_LENGTH)
+    return model.to(device)
+
+# Model held by each encoder process in the multi-process pool
+_worker_model = None
+
+def _init_encode_worker(threads):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = load_model('cpu')
+
+def _encode_in_worker(texts):
+    return _worker_model.encode(texts, normalize_embeddings=True, batch_size=len(texts), convert_to_numpy=True)
+
+class EmbeddingEngine:
+    """Length-sorted, token-budgeted chunk encoder with an optional multi-process pool
+
+    Texts are sorted by token length so each batch pads to a similar length,
+    and a batch grows until its padded size would exceed the token budget.
+    With workers > 1 (CPU only) batches are spread over encoder processes.
+    One engine can be shared by threads: encode calls run one at a time,
+    since the tokenizer is not thread-safe and parallel inference would only
+    oversubscribe the CPU.
+    """
+
+    def __init__(self, device=None, token_budget=EMBED_TOKEN_BUDGET, max_batch=INGEST_EMBED_MAX_BATCH,
+                 workers=EMBED_WORKERS):
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.token_budget = token_budget
+        self.max_batch = max_batch
+        self.model = load_model(self.device)
+        self.tokenizer = self.model.tokenizer
+        self.max_seq_length = self.model.max_seq_length
+        self.pool = None
+        self.lock = threading.Lock()
+        
+        if workers > 1 and self.device == 'cpu':
+            threads = max(1, (os.cpu_count() or workers) // workers)
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_encode_worker,
+                initargs=(threads,)
+            )
+            print(f"Started {workers} encoder processes ({threads} threads each)")
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+    def token_lengths(self, texts):
+        encoded = self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+        return [len(ids) for ids in encoded["input_ids"]]
+
+    def plan_batches(self, lengths):
+        """Group text indices into batches whose padded size fits the token budget"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches = []
+        current = []
+        for idx in order:
+            # Sorted ascending, so the newest text is the longest in the batch
+            padded = (len(current) + 1) * lengths[idx]
+            if current and (padded > self.token_budget or len(current) >= self.max_batch):
+                batches.append(current)
+                current = []
+            current.append(idx)
+        if current:
+            batches.append(current)
+        return batches
+
+    def encode(self, texts):
+        """Return normalized float32 embeddings in the same order as texts"""
+        embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        if not texts:
+            return embeddings
+        
+        with self.lock:
+            batches = self.plan_batches(self.token_lengths(texts))
+            batch_texts = [[texts[i] for i in batch] for batch in batches]
+            
+            if self.pool:
+                results = self.pool.map(_encode_in_worker, batch_texts)
+            else:
+                results = (
+                    self.model.encode(chunk, normalize_embeddings=True, batch_size=len(chunk), convert_to_numpy=True)
+                    for chunk in batch_texts
+                )
+            
+            for batch, vectors in zip(batches, results):
+                embeddings[batch] = vectors
+        return embeddings
+
+def create_staging_table(cur):
+    """Create the session-local table that embedding batches are copied into"""
+    cur.execute(f"""
+        CREATE TEMP TABLE IF NOT EXISTS embedding_staging (
+            chunk_id   INT NOT NULL,
+            embedding  VECTOR({EMBEDDING_DIM}) NOT NULL
+        ) ON COMMIT DELETE ROWS;
+    """)
+
+def encode_copy_binary(chunk_ids, embeddings):
+    """Encode (chunk_id, vector) rows in PostgreSQL binary COPY format
+
+    Each vector field uses pgvector's binary layout: int16 dim, int16 unused,
+    then dim big-endian float4 values.
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    rows, dim = embeddings.shape
+    row_type = np.dtype([
+        ('field_count', '>i2'),
+        ('id_len', '>i4'), ('chunk_id', '>i4'),
+        ('vec_len', '>i4'), ('dim', '>i2'), ('unused', '>i2'),
+        ('values', '>f4', (dim,))
+    ])
+    records = np.empty(rows, dtype=row_type)
+    records['field_count'] = 2
+    records['id_len'] = 4
+    records['chunk_id'] = chunk_ids
+    records['vec_len'] = 4 + 4 * dim
+    records['dim'] = dim
+    records['unused'] = 0
+    records['values'] = embeddings
+    
+    buf = io.BytesIO()
+    buf.write(b'PGCOPY\n\xff\r\n\x00')      # signature
+    buf.write(np.array([0, 0], dtype='>i4').tobytes())  # flags, header extension
+    buf.write(records.tobytes())
+    buf.write(np.array([-1], dtype='>i2').tobytes())    # trailer
+    buf.seek(0)
+    return buf
+
+def write_embeddings(cur, chunk_ids, embeddings):
+    """COPY a batch of embeddings into staging and apply them with one UPDATE"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[1] != EMBEDDING_DIM:
+        raise ValueError(f"Embedding shape {embeddings.shape} does not match dimension {EMBEDDING_DIM}")
     
-    # Use device detection for better performance
-    device = 'cuda' if torch.cuda.is_available() else 'cpu'
-    print(f"Using device: {device}")
+    cur.copy_expert(
+        "COPY embedding_staging (chunk_id, embedding) FROM STDIN WITH (FORMAT binary)",
+        encode_copy_binary(chunk_ids, embeddings)
+    )
+    cur.execute("""
+        UPDATE doc_chunks dc
+        SET embedding = s.embedding, embedded_at = NOW()
+        FROM embedding_staging s
+        WHERE dc.chunk_id = s.chunk_id;
+    """)
+
+def embed_document(doc_id, engine, conn=None, page_size=FETCH_PAGE_SIZE, progress=None):
+    """Embed only the pending chunks of one document, returning how many were embedded
+
+    progress, if given, is called as progress("embedding", done, total)
+    after every page.
+    """
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection()
     
-    model = SentenceTransformer("Alibaba-NLP/gte-multilingual-base", trust_remote_code=True)
-    model = model.to(device)
-    print("Model loaded successfully!")
+    cur = conn.cursor()
+    try:
+        create_staging_table(cur)
+        cur.execute(
+            "SELECT chunk_id, chunk_text FROM doc_chunks WHERE doc_id = %s AND embedding IS NULL ORDER BY chunk_index;",
+            (doc_id,)
+        )
+        rows = cur.fetchall()
+        conn.commit()
+        
+        embedded = 0
+        if progress:
+            progress("embedding", 0, len(rows))
+        for i in range(0, len(rows), page_size):
+            page = rows[i:i + page_size]
+            embeddings = engine.encode([row[1] for row in page])
+            write_embeddings(cur, [row[0] for row in page], embeddings)
+            conn.commit()
+            embedded += len(page)
+            print(f"  - Embedded {embedded}/{len(rows)} chunks of document {doc_id}")
+            if progress:
+                progress("embedding", embedded, len(rows))
+        return embedded
+        
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        if owns_conn:
+            conn.close()
+
+def compute_embeddings(engine=None):
+    """Compute embeddings for all chunks without embeddings
+
+    A long-lived caller can pass a loaded EmbeddingEngine to reuse the model.
+    """
+    owns_engine = engine is None
+    if owns_engine:
+        print("Loading embedding model...")
+        
+        # Use device detection for better performance
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        print(f"Using device: {device}")
+        
+        engine = EmbeddingEngine(device=device)
+        print("Model loaded successfully!")
+    device = engine.device
    
     conn = None
     cur = None
+    read_conn = None
     
     try:
         conn = get_db_connection()
         cur = conn.cursor()
+        create_staging_table(cur)
+        conn.commit()
        
-        # Get chunks without embeddings
-        cur.execute("SELECT chunk_id, chunk_text FROM doc_chunks WHERE embedding IS NULL ORDER BY chunk_id;")
-        rows = cur.fetchall()
+        # Count chunks without embeddings; the rows themselves are streamed
+        cur.execute("SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NULL;")
+        total_pending = cur.fetchone()[0]
+        conn.commit()
        
-        if not rows:
+        if not total_pending:
             print("No chunks need embedding!")
             return
        
-        print(f"Computing embeddings for {len(rows)} chunks...")
+        print(f"Computing embeddings for {total_pending} chunks...")
        
-        batch_size = 8 if device == 'cuda' else 16  # Smaller batch for GPU to avoid memory issues
+        total_pages = (total_pending + FETCH_PAGE_SIZE - 1)//FETCH_PAGE_SIZE
         processed = 0
+        page_num = 0
         
-        for i in range(0, len(rows), batch_size):
-            batch = rows[i:i + batch_size]
-            batch_num = i//batch_size + 1
-            total_batches = (len(rows) + batch_size - 1)//batch_size
-            
-            print(f"Processing batch {batch_num}/{total_batches} ({len(batch)} chunks)")
+        # Separate connection for the server-side cursor, so per-page commits don't close it
+        read_conn = get_db_connection()
+        
+        for page in prefetch(iter_pending_chunks(read_conn)):
+            page_num += 1
+            print(f"Processing page {page_num}/{total_pages} ({len(page)} chunks)")
            
-            # Extract texts for batch processing
-            chunk_ids = [row[0] for row in batch]
-            texts = [row[1] for row in batch]
+            chunk_ids = [row[0] for row in page]
+            texts = [row[1] for row in page]
             
             try:
-                # Compute embeddings for the entire batch
-                embeddings = model.encode(texts, normalize_embeddings=True, batch_size=len(texts))
+                # Length-sorted, token-budgeted batches for the whole page
+                embeddings = engine.encode(texts)
                 
                 # Verify embedding dimensions and update database
-                for chunk_id, embedding in zip(chunk_ids, embeddings):
-                    embedding_list = embedding.tolist()
-                    
-                    # Verify embedding dimension
-                    if len(embedding_list) != 768:
-                        raise ValueError(f"Embedding dimension {len(embedding_list)} != 768 for chunk {chunk_id}")
-                    
-                    # Update database
-                    cur.execute(
-                        "UPDATE doc_chunks SET embedding = %s WHERE chunk_id = %s;",
-                        (embedding_list, chunk_id)
-                    )
+                write_embeddings(cur, chunk_ids, embeddings)
                 
                 conn.commit()
-                processed += len(batch)
-                print(f"  - Processed {processed}/{len(rows)} chunks")
+                processed += len(page)
+                print(f"  - Processed {processed}/{total_pending} chunks")
                 
                 # Clear memory periodically
-                if batch_num % 10 == 0:
+                if page_num % 10 == 0:
                     gc.collect()
                     if device == 'cuda':
                         torch.cuda.empty_cache()
                
             except Exception as e:
-                print(f"Error processing batch {batch_num}: {e}")
+                print(f"Error processing page {page_num}: {e}")
                 conn.rollback()
-                # Continue with next batch instead of failing completely
+                # Continue with next page instead of failing completely
                 continue
        
-        print(f"\nSuccessfully processed {processed}/{len(rows)} chunks")
-        
-        # Check if we have enough data points for index training
-        cur.execute("SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NOT NULL;")
-        embedding_count = cur.fetchone()[0]
+        print(f"\nSuccessfully processed {processed}/{total_pending} chunks")
         
-        if embedding_count >= 100:  # Minimum recommended for IVFFlat
-            print("Training ANN index...")
-            try:
-                # First, check if the index exists and has data
-                cur.execute("""
-                    SELECT COUNT(*) FROM pg_stat_user_indexes 
-                    WHERE indexrelname = 'idx_chunks_embedding';
-                """)
-                
-                if cur.fetchone()[0] > 0:
-                    # Try to train the index
-                    cur.execute("SELECT ivfflat_train('idx_chunks_embedding');")
-                    conn.commit()
-                    print("Index training completed!")
-                else:
-                    print("Index not found, it will be auto-trained on first use.")
-                    
-            except Exception as e:
-                print(f"Index training warning (this is normal for small datasets): {e}")
-                # Index training failure is not critical
-                pass
-        else:
-            print(f"Only {embedding_count} embeddings computed. Index training requires at least 100 vectors.")
+        # Build or resize the ANN index now that the vectors are loaded
+        try:
+            ensure_index(conn)
+        except Exception as e:
+            # Searches still work (more slowly) without a fresh index
+            print(f"Index maintenance warning: {e}")
    
     except Exception as e:
         print(f"Critical error in compute_embeddings: {e}")
@@ -137,6 +380,10 @@ def compute_embeddings():
             cur.close()
         if conn:
             conn.close()
+        if read_conn:
+            read_conn.close()
+        if owns_engine:
+            engine.close()
         
         # Clean up GPU memory
         if device == 'cuda':
@@ -1,16 +1,27 @@
 import os
 import psycopg2
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
+from docling.datamodel.base_models import InputFormat, DocumentStream
 from docling.document_converter import PdfFormatOption
 from docling.datamodel.pipeline_options import PdfPipelineOptions
+import io
 import json
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 # Load environment variables
 load_dotenv()
 
+# Conversion worker processes (1 converts in this process)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Split PDFs longer than this many pages into page-range tasks (0 disables splitting)
+INGEST_PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "0"))
+
 def get_db_connection():
     """Create and return database connection"""
     conn_params = {
@@ -22,6 +33,85 @@ def get_db_connection():
     }
     return psycopg2.connect(**conn_params)
 
+def text_hash(text):
+    """SHA-256 of a chunk's text (matches the backfill in setup_database.py)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def classify_chunk(text):
+    """Chunk type used for table-aware retrieval: "table", "table_part" or "text"
+
+    Same rules as the backfill in setup_database.py.
+    """
+    if "TABLE DATA:" in text:
+        return "table"
+    if "|" in text and ("---|" in text or text.count("|") > 10):
+        return "table_part"
+    return "text"
+
+def content_hash(source):
+    """SHA-256 of a PDF's bytes, given a path or the bytes themselves"""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    digest = hashlib.sha256()
+    with open(source, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def insert_chunks(cur, doc_id, chunks, indexes=None, page_size=500):
+    """Insert chunks of a document with batched multi-row INSERTs"""
+    if indexes is None:
+        indexes = range(len(chunks))
+    execute_values(
+        cur,
+        "INSERT INTO doc_chunks (doc_id, chunk_index, chunk_text, text_hash, chunk_type, embedding) VALUES %s",
+        [(doc_id, idx, chunk, text_hash(chunk), classify_chunk(chunk)) for idx, chunk in zip(indexes, chunks)],
+        template="(%s, %s, %s, %s, %s, NULL)",
+        page_size=page_size
+    )
+
+def sync_chunks(cur, doc_id, chunks):
+    """Replace a document's chunks, keeping rows (and embeddings) whose text is unchanged
+
+    Returns (kept, added, removed) counts. Only added chunks need embedding.
+    """
+    cur.execute("SELECT chunk_id, chunk_index, text_hash FROM doc_chunks WHERE doc_id = %s;", (doc_id,))
+    available = {}
+    for chunk_id, chunk_index, chunk_hash in cur.fetchall():
+        available.setdefault(chunk_hash, []).append((chunk_id, chunk_index))
+    
+    moved = []
+    new_indexes = []
+    new_chunks = []
+    kept = 0
+    for idx, chunk in enumerate(chunks):
+        candidates = available.get(text_hash(chunk))
+        if candidates:
+            chunk_id, old_index = candidates.pop(0)
+            kept += 1
+            if old_index != idx:
+                moved.append((chunk_id, idx))
+        else:
+            new_indexes.append(idx)
+            new_chunks.append(chunk)
+    
+    stale = [chunk_id for rows in available.values() for chunk_id, _ in rows]
+    if stale:
+        cur.execute("DELETE FROM doc_chunks WHERE chunk_id = ANY(%s);", (stale,))
+    if moved:
+        execute_values(
+            cur,
+            """
+            UPDATE doc_chunks SET chunk_index = v.chunk_index
+            FROM (VALUES %s) AS v(chunk_id, chunk_index)
+            WHERE doc_chunks.chunk_id = v.chunk_id
+            """,
+            moved
+        )
+    if new_chunks:
+        insert_chunks(cur, doc_id, new_chunks, indexes=new_indexes)
+    return kept, len(new_chunks), len(stale)
+
 def chunk_text(text, chunk_size=500, overlap=100):
     """Split text into overlapping chunks"""
     if not text or not text.strip():
@@ -151,29 +241,8 @@ def chunk_text_with_tables(text, chunk_size=500, overlap=100):
     
     return [chunk.strip() for chunk in chunks if chunk.strip()]
 
-def ingest_pdfs():
-    """Extract and ingest PDFs into database using Docling"""
-    # Determine the absolute path to the project's root directory
-    script_dir = Path(__file__).parent
-    project_root = script_dir.parent
-    pdf_dir = project_root / "data" / "pdfs"
-    
-    print(f"Looking for PDFs in: {pdf_dir}")
-    
-    if not pdf_dir.exists():
-        print(f"PDF directory {pdf_dir} does not exist!")
-        print("Please create the directory and add PDF files to process.")
-        return
-    
-    pdf_files = [f for f in pdf_dir.iterdir() if f.suffix.lower() == '.pdf']
-    
-    if not pdf_files:
-        print(f"No PDF files found in {pdf_dir}")
-        return
-    
-    print(f"Found {len(pdf_files)} PDF files to process")
-    
-    # Initialize Docling converter with better pipeline options
+def create_converter():
+    """Initialize a Docling converter with OCR and table structure enabled"""
     try:
         # Configure pipeline options for better extraction
         pipeline_options = PdfPipelineOptions(
@@ -187,15 +256,334 @@ def ingest_pdfs():
             }
         )
         print("Docling converter initialized successfully!")
+        return converter
     except Exception as e:
         print(f"Error initializing Docling converter: {e}")
         print("Falling back to basic converter...")
         try:
             converter = DocumentConverter()
             print("Basic Docling converter initialized!")
+            return converter
         except Exception as e2:
             print(f"Failed to initialize any converter: {e2}")
-            return
+            return None
+
+def extract_text(document):
+    """Get the text of a converted Docling document, trying several export methods"""
+    # Method 1: Try to get markdown export (most comprehensive)
+    try:
+        raw_text = document.export_to_markdown()
+        print(f"  - Extracted text using markdown export (length: {len(raw_text)})")
+    except Exception as e:
+        print(f"  - Markdown export failed: {e}")
+        raw_text = ""
+    
+    # Method 2: If markdown export fails, try export_to_text
+    if not raw_text.strip():
+        try:
+            raw_text = document.export_to_text()
+            print(f"  - Extracted text using text export (length: {len(raw_text)})")
+        except Exception as e:
+            print(f"  - Text export failed: {e}")
+            raw_text = ""
+    
+    # Method 3: If both exports fail, try accessing document structure directly
+    if not raw_text.strip():
+        try:
+            text_parts = []
+            
+            # Try to access document body
+            if hasattr(document, 'body') and document.body:
+                for element in document.body:
+                    if hasattr(element, 'text') and element.text:
+                        text_parts.append(element.text.strip())
+            
+            # Try to access document texts
+            if hasattr(document, 'texts') and document.texts:
+                for text_element in document.texts:
+                    if hasattr(text_element, 'text') and text_element.text:
+                        text_parts.append(text_element.text.strip())
+            
+            raw_text = "\n\n".join(text_parts)
+            print(f"  - Extracted text using direct access (length: {len(raw_text)})")
+            
+        except Exception as e:
+            print(f"  - Direct access failed: {e}")
+            raw_text = ""
+    
+    # Method 4: Last resort - try to convert to dict and extract text
+    if not raw_text.strip():
+        try:
+            doc_dict = document.export_to_dict()
+            text_parts = []
+            
+            def extract_text_recursive(obj):
+                if isinstance(obj, dict):
+                    if 'text' in obj and obj['text']:
+                        text_parts.append(str(obj['text']).strip())
+                    for value in obj.values():
+                        extract_text_recursive(value)
+                elif isinstance(obj, list):
+                    for item in obj:
+                        extract_text_recursive(item)
+            
+            extract_text_recursive(doc_dict)
+            raw_text = "\n\n".join(text_parts)
+            print(f"  - Extracted text using recursive dict parsing (length: {len(raw_text)})")
+            
+        except Exception as e:
+            print(f"  - Recursive dict parsing failed: {e}")
+            raw_text = ""
+    
+    return raw_text
+
+def convert_pdf(converter, pdf_path, page_range=None):
+    """Convert a PDF (or a 1-based inclusive page range of it) to text
+
+    pdf_path may also be a Docling DocumentStream for in-memory PDFs.
+    """
+    source = pdf_path if isinstance(pdf_path, DocumentStream) else str(pdf_path)
+    if page_range:
+        result = converter.convert(source, page_range=page_range)
+    else:
+        result = converter.convert(source)
+    
+    if not result or not result.document:
+        print(f"  - No document result from Docling for {source_label(pdf_path)}")
+        return ""
+    return extract_text(result.document)
+
+def source_label(pdf_path):
+    return pdf_path.name if isinstance(pdf_path, DocumentStream) else Path(pdf_path).name
+
+def count_pages(pdf_path):
+    """Return the page count of a PDF (path or bytes), or None if it can't be read"""
+    try:
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(pdf_path if isinstance(pdf_path, bytes) else str(pdf_path))
+        page_count = len(pdf)
+        pdf.close()
+        return page_count
+    except Exception as e:
+        print(f"  - Could not read page count of PDF: {e}")
+        return None
+
+def split_page_ranges(pdf_path, pages_per_task, page_count=None):
+    """Split a PDF (path or bytes) into page ranges of at most pages_per_task pages"""
+    if pages_per_task <= 0:
+        return [None]
+    if page_count is None:
+        page_count = count_pages(pdf_path)
+    if page_count is None or page_count <= pages_per_task:
+        return [None]
+    return [
+        (start, min(start + pages_per_task - 1, page_count))
+        for start in range(1, page_count + 1, pages_per_task)
+    ]
+
+# Converter held by each conversion worker process
+_worker_converter = None
+
+def _init_convert_worker():
+    global _worker_converter
+    _worker_converter = create_converter()
+
+def _convert_in_worker(pdf_path, page_range):
+    if _worker_converter is None:
+        raise RuntimeError("Docling converter failed to initialize in worker")
+    return convert_pdf(_worker_converter, pdf_path, page_range)
+
+def find_existing_document(cur, filename, file_hash):
+    """Decide how to handle a file, returning (action, doc_id)
+
+    "duplicate": the same content is already ingested (under any name)
+    "changed":   a document with this name exists with different content
+                 (or was ingested before content hashes were recorded)
+    "new":       nothing matches
+    """
+    cur.execute("SELECT id, source_name FROM documents WHERE content_hash = %s LIMIT 1;", (file_hash,))
+    row = cur.fetchone()
+    if row:
+        return "duplicate", row[0]
+    
+    cur.execute("SELECT id FROM documents WHERE source_name = %s;", (filename,))
+    row = cur.fetchone()
+    if row:
+        return "changed", row[0]
+    return "new", None
+
+def store_document(conn, cur, filename, raw_text, file_hash=None, doc_id=None):
+    """Chunk the extracted text and write the document and its chunks in one transaction
+
+    With doc_id, the existing document is updated in place and only chunks
+    whose text changed are replaced.
+    """
+    if not raw_text.strip():
+        print(f"  - No text extracted from {filename}, skipping...")
+        return None
+    
+    # Clean up the text
+    raw_text = raw_text.strip()
+    
+    # Chunk the text
+    chunks = chunk_text_with_tables(raw_text, chunk_size=600, overlap=150)  # Larger chunks for tables
+    print(f"  - Created {len(chunks)} chunks for {filename}")
+    
+    if not chunks:
+        print(f"  - No chunks created for {filename}")
+        return None
+    
+    if doc_id is None:
+        # Insert document
+        cur.execute(
+            "INSERT INTO documents (source_name, raw_text, content_hash) VALUES (%s, %s, %s) RETURNING id;",
+            (filename, raw_text, file_hash)
+        )
+        doc_id = cur.fetchone()[0]
+        
+        # Insert chunks
+        insert_chunks(cur, doc_id, chunks)
+    else:
+        # Changed document: update in place and diff the chunks
+        cur.execute(
+            "UPDATE documents SET raw_text = %s, content_hash = %s, uploaded_at = NOW() WHERE id = %s;",
+            (raw_text, file_hash, doc_id)
+        )
+        kept, added, removed = sync_chunks(cur, doc_id, chunks)
+        print(f"  - Updated {filename}: kept {kept}, added {added}, removed {removed} chunks")
+    
+    conn.commit()
+    print(f"  - Successfully processed {filename} (Document ID: {doc_id})")
+    
+    # Show a sample of the extracted text
+    sample_text = raw_text[:200] + "..." if len(raw_text) > 200 else raw_text
+    print(f"  - Sample text: {sample_text}")
+    return doc_id
+
+def ingest_document(source, source_name, converter=None, conn=None,
+                    pages_per_task=INGEST_PAGES_PER_TASK, progress=None):
+    """Convert, chunk and store a single PDF, returning its document id
+
+    source is a file path or the PDF bytes, and source_name identifies the
+    document. Only this document is touched, so the cost depends on its size
+    rather than on the contents of data/pdfs or the rest of the corpus. If
+    identical content was already ingested that document's id is returned
+    unchanged; if a document with this name exists with different content it
+    is updated in place, and only its changed chunks lose their embeddings.
+    
+    progress, if given, is called as progress(stage, done, total) with
+    "converting" (pages) and "chunking" (chunks created).
+    """
+    def report(stage, done, total):
+        if progress:
+            progress(stage, done, total)
+    
+    owns_conn = conn is None
+    if owns_conn:
+        conn = get_db_connection()
+    if converter is None:
+        converter = create_converter()
+        if converter is None:
+            raise RuntimeError("Failed to initialize the Docling converter")
+    
+    cur = conn.cursor()
+    try:
+        file_hash = content_hash(source)
+        action, existing_id = find_existing_document(cur, source_name, file_hash)
+        conn.commit()
+        if action == "duplicate":
+            print(f"  - {source_name} has identical content to document {existing_id}, skipping...")
+            return existing_id
+        
+        print(f"\nProcessing {source_name}...")
+        page_count = count_pages(source)
+        report("converting", 0, page_count)
+        
+        parts = []
+        for page_range in split_page_ranges(source, pages_per_task, page_count):
+            # A fresh stream per conversion, since Docling consumes it
+            pdf = DocumentStream(name=source_name, stream=io.BytesIO(source)) if isinstance(source, bytes) else source
+            part = convert_pdf(converter, pdf, page_range)
+            if part.strip():
+                parts.append(part.strip())
+            report("converting", page_range[1] if page_range else page_count, page_count)
+        
+        doc_id = store_document(conn, cur, source_name, "\n\n".join(parts),
+                                file_hash=file_hash, doc_id=existing_id)
+        if doc_id is None:
+            raise ValueError(f"No text could be extracted from {source_name}")
+        
+        cur.execute("SELECT COUNT(*) FROM doc_chunks WHERE doc_id = %s;", (doc_id,))
+        chunk_count = cur.fetchone()[0]
+        report("chunking", chunk_count, chunk_count)
+        return doc_id
+        
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+        if owns_conn:
+            conn.close()
+
+def convert_in_pool(pdf_files, workers, pages_per_task):
+    """Convert PDFs in worker processes, yielding (pdf_file, raw_text or exception)
+
+    Each worker keeps one warmed converter. Large PDFs are split into page
+    ranges, and a file is yielded once all of its ranges are converted.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_init_convert_worker) as executor:
+        parts = {}
+        futures = {}
+        for pdf_file in pdf_files:
+            ranges = split_page_ranges(pdf_file, pages_per_task)
+            parts[pdf_file] = [None] * len(ranges)
+            for position, page_range in enumerate(ranges):
+                future = executor.submit(_convert_in_worker, str(pdf_file), page_range)
+                futures[future] = (pdf_file, position)
+        
+        failed = set()
+        for future in as_completed(futures):
+            pdf_file, position = futures[future]
+            if pdf_file in failed:
+                continue
+            try:
+                parts[pdf_file][position] = future.result()
+            except Exception as e:
+                failed.add(pdf_file)
+                yield pdf_file, e
+                continue
+            if all(part is not None for part in parts[pdf_file]):
+                yield pdf_file, "\n\n".join(part.strip() for part in parts[pdf_file] if part.strip())
+                del parts[pdf_file]
+
+def ingest_pdfs(workers=INGEST_WORKERS, pages_per_task=INGEST_PAGES_PER_TASK, converter=None):
+    """Extract and ingest PDFs into database using Docling
+
+    A long-lived caller can pass an already initialized converter to skip
+    loading the Docling models again.
+    """
+    # Determine the absolute path to the project's root directory
+    script_dir = Path(__file__).parent
+    project_root = script_dir.parent
+    pdf_dir = project_root / "data" / "pdfs"
+    
+    print(f"Looking for PDFs in: {pdf_dir}")
+    
+    if not pdf_dir.exists():
+        print(f"PDF directory {pdf_dir} does not exist!")
+        print("Please create the directory and add PDF files to process.")
+        return
+    
+    pdf_files = [f for f in pdf_dir.iterdir() if f.suffix.lower() == '.pdf']
+    
+    if not pdf_files:
+        print(f"No PDF files found in {pdf_dir}")
+        return
+    
+    print(f"Found {len(pdf_files)} PDF files to process")
     
     conn = None
     cur = None
@@ -205,142 +593,72 @@ def ingest_pdfs():
         cur = conn.cursor()
         print("Database connection established!")
         
+        # Check which files are new or changed before converting anything
+        pending_files = []
+        file_state = {}  # pdf_file -> (content hash, existing doc id or None)
+        for pdf_file in pdf_files:
+            file_hash = content_hash(pdf_file)
+            action, existing_id = find_existing_document(cur, pdf_file.name, file_hash)
+            if action == "duplicate":
+                print(f"  - {pdf_file.name} already processed (ID: {existing_id}), skipping...")
+                continue
+            if action == "changed":
+                print(f"  - {pdf_file.name} changed since it was ingested (ID: {existing_id}), re-ingesting...")
+            file_state[pdf_file] = (file_hash, existing_id)
+            pending_files.append(pdf_file)
+        conn.commit()
+        
         processed_count = 0
         
-        for pdf_file in pdf_files:
-            filename = pdf_file.name
+        if workers > 1 and pending_files:
+            # Parallel conversion; this process is the single DB writer
+            print(f"Converting {len(pending_files)} PDFs with {workers} worker processes...")
+            for pdf_file, outcome in convert_in_pool(pending_files, workers, pages_per_task):
+                filename = pdf_file.name
+                try:
+                    if isinstance(outcome, Exception):
+                        raise outcome
+                    print(f"\nStoring {filename}...")
+                    file_hash, existing_id = file_state[pdf_file]
+                    if store_document(conn, cur, filename, outcome, file_hash=file_hash, doc_id=existing_id):
+                        processed_count += 1
+                except Exception as e:
+                    print(f"  - Error processing {filename}: {e}")
+                    if conn:
+                        conn.rollback()
+        elif pending_files:
+            # Initialize Docling converter with better pipeline options
+            if converter is None:
+                converter = create_converter()
+            if converter is None:
+                return
             
-            try:
-                print(f"\nProcessing {filename}...")
-                
-                # Check if file already processed
-                cur.execute("SELECT id FROM documents WHERE source_name = %s", (filename,))
-                existing_doc = cur.fetchone()
-                
-                if existing_doc:
-                    print(f"  - {filename} already processed (ID: {existing_doc[0]}), skipping...")
-                    continue
+            for pdf_file in pending_files:
+                filename = pdf_file.name
                 
-                # Process PDF with Docling
-                print(f"  - Converting PDF with Docling...")
-                result = converter.convert(str(pdf_file))
-                
-                if not result or not result.document:
-                    print(f"  - No document result from Docling for {filename}")
-                    continue
-                
-                # Method 1: Try to get markdown export (most comprehensive)
                 try:
-                    raw_text = result.document.export_to_markdown()
-                    print(f"  - Extracted text using markdown export (length: {len(raw_text)})")
+                    print(f"\nProcessing {filename}...")
+                    
+                    # Process PDF with Docling
+                    print(f"  - Converting PDF with Docling...")
+                    raw_text = "\n\n".join(
+                        part.strip()
+                        for part in (
+                            convert_pdf(converter, pdf_file, page_range)
+                            for page_range in split_page_ranges(pdf_file, pages_per_task)
+                        )
+                        if part.strip()
+                    )
+                    
+                    file_hash, existing_id = file_state[pdf_file]
+                    if store_document(conn, cur, filename, raw_text, file_hash=file_hash, doc_id=existing_id):
+                        processed_count += 1
+                    
                 except Exception as e:
-                    print(f"  - Markdown export failed: {e}")
-                    raw_text = ""
-                
-                # Method 2: If markdown export fails, try export_to_text
-                if not raw_text.strip():
-                    try:
-                        raw_text = result.document.export_to_text()
-                        print(f"  - Extracted text using text export (length: {len(raw_text)})")
-                    except Exception as e:
-                        print(f"  - Text export failed: {e}")
-                        raw_text = ""
-                
-                # Method 3: If both exports fail, try accessing document structure directly
-                if not raw_text.strip():
-                    try:
-                        text_parts = []
-                        
-                        # Try to access document body
-                        if hasattr(result.document, 'body') and result.document.body:
-                            for element in result.document.body:
-                                if hasattr(element, 'text') and element.text:
-                                    text_parts.append(element.text.strip())
-                        
-                        # Try to access document texts
-                        if hasattr(result.document, 'texts') and result.document.texts:
-                            for text_element in result.document.texts:
-                                if hasattr(text_element, 'text') and text_element.text:
-                                    text_parts.append(text_element.text.strip())
-                        
-                        raw_text = "\n\n".join(text_parts)
-                        print(f"  - Extracted text using direct access (length: {len(raw_text)})")
-                        
-                    except Exception as e:
-                        print(f"  - Direct access failed: {e}")
-                        raw_text = ""
-                
-                # Method 4: Last resort - try to convert to dict and extract text
-                if not raw_text.strip():
-                    try:
-                        doc_dict = result.document.export_to_dict()
-                        text_parts = []
-                        
-                        def extract_text_recursive(obj):
-                            if isinstance(obj, dict):
-                                if 'text' in obj and obj['text']:
-                                    text_parts.append(str(obj['text']).strip())
-                                for value in obj.values():
-                                    extract_text_recursive(value)
-                            elif isinstance(obj, list):
-                                for item in obj:
-                                    extract_text_recursive(item)
-                        
-                        extract_text_recursive(doc_dict)
-                        raw_text = "\n\n".join(text_parts)
-                        print(f"  - Extracted text using recursive dict parsing (length: {len(raw_text)})")
-                        
-                    except Exception as e:
-                        print(f"  - Recursive dict parsing failed: {e}")
-                        raw_text = ""
-                
-                if not raw_text.strip():
-                    print(f"  - No text extracted from {filename}, skipping...")
+                    print(f"  - Error processing {filename}: {e}")
+                    if conn:
+                        conn.rollback()
                     continue
-                
-                # Clean up the text
-                raw_text = raw_text.strip()
-                
-                # Insert document
-                cur.execute(
-                    "INSERT INTO documents (source_name, raw_text) VALUES (%s, %s) RETURNING id;",
-                    (filename, raw_text)
-                )
-                doc_id = cur.fetchone()[0]
-                
-                # Chunk the text
-                chunks = chunk_text_with_tables(raw_text, chunk_size=600, overlap=150)  # Larger chunks for tables
-                print(f"  - Created {len(chunks)} chunks")
-                
-                if not chunks:
-                    print(f"  - No chunks created for {filename}")
-                    # Delete the document record since we couldn't create chunks
-                    cur.execute("DELETE FROM documents WHERE id = %s", (doc_id,))
-                    continue
-                
-                # Insert chunks
-                for idx, chunk in enumerate(chunks):
-                    cur.execute(
-                        """
-                        INSERT INTO doc_chunks (doc_id, chunk_index, chunk_text, embedding)
-                        VALUES (%s, %s, %s, NULL);
-                        """,
-                        (doc_id, idx, chunk)
-                    )
-                
-                conn.commit()
-                processed_count += 1
-                print(f"  - Successfully processed {filename} (Document ID: {doc_id})")
-                
-                # Show a sample of the extracted text
-                sample_text = raw_text[:200] + "..." if len(raw_text) > 200 else raw_text
-                print(f"  - Sample text: {sample_text}")
-                
-            except Exception as e:
-                print(f"  - Error processing {filename}: {e}")
-                if conn:
-                    conn.rollback()
-                continue
         
         print(f"\nPDF ingestion completed! Successfully processed {processed_count}/{len(pdf_files)} files.")
         
@@ -374,4 +692,10 @@ def ingest_pdfs():
             conn.close()
 
 if __name__ == "__main__":
-    ingest_pdfs()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Extract and ingest PDFs from data/pdfs")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="Number of conversion worker processes")
+    parser.add_argument("--pages-per-task", type=int, default=INGEST_PAGES_PER_TASK,
+                        help="Split PDFs into page ranges of this size (0 disables)")
+    args = parser.parse_args()
+    ingest_pdfs(workers=args.workers, pages_per_task=args.pages_per_task)
@@ -0,0 +1,227 @@
+import psycopg2
+import os
+import math
+import argparse
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+INDEX_NAME = "idx_chunks_embedding"
+
+# Partial indexes so table-aware retrieval gets an index-backed top-k per chunk type.
+# Text chunks are searched through the main index.
+PARTIAL_INDEXES = {
+    "idx_chunks_embedding_table": "chunk_type = 'table'",
+    "idx_chunks_embedding_table_part": "chunk_type = 'table_part'",
+}
+VECTOR_INDEXES = {INDEX_NAME: None, **PARTIAL_INDEXES}  # name -> WHERE predicate
+
+# Distance metric; must match VECTOR_METRIC in api/app_retrieve.py.
+# Embeddings are stored normalized, so ip (dot product) ranks like cosine but is cheaper.
+VECTOR_METRIC = os.getenv("VECTOR_METRIC", "ip").lower()
+VECTOR_OPCLASSES = {
+    "l2": "vector_l2_ops",
+    "cosine": "vector_cosine_ops",
+    "ip": "vector_ip_ops",
+}
+if VECTOR_METRIC not in VECTOR_OPCLASSES:
+    raise ValueError(f"VECTOR_METRIC must be one of {sorted(VECTOR_OPCLASSES)}, got {VECTOR_METRIC!r}")
+VECTOR_OPCLASS = VECTOR_OPCLASSES[VECTOR_METRIC]
+
+# Index type and build parameters
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()  # hnsw or ivfflat
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# 0 sizes lists from the row count (rows/1000 up to 1M rows, sqrt(rows) above)
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "0"))
+# Rebuild IVFFlat once the ideal lists value drifts this far from the built one
+IVFFLAT_REBUILD_FACTOR = float(os.getenv("IVFFLAT_REBUILD_FACTOR", "2"))
+INDEX_MAINTENANCE_WORK_MEM = os.getenv("INDEX_MAINTENANCE_WORK_MEM", "512MB")
+
+def get_db_connection():
+    """Create and return database connection"""
+    conn_params = {
+        'dbname': os.getenv('DB_NAME'),
+        'user': os.getenv('DB_USER'),
+        'password': os.getenv('DB_PASSWORD'),
+        'host': os.getenv('DB_HOST'),
+        'port': os.getenv('DB_PORT')
+    }
+    return psycopg2.connect(**conn_params)
+
+def ivfflat_lists(row_count):
+    """Number of IVFFlat lists for a table of row_count vectors"""
+    if IVFFLAT_LISTS > 0:
+        return IVFFLAT_LISTS
+    if row_count <= 1_000_000:
+        return max(1, row_count // 1000)
+    return int(math.sqrt(row_count))
+
+def count_embedded(cur, where=None):
+    """Embedded rows covered by an index with the given predicate"""
+    predicate = f" AND {where}" if where else ""
+    cur.execute(f"SELECT COUNT(*) FROM doc_chunks WHERE embedding IS NOT NULL{predicate};")
+    return cur.fetchone()[0]
+
+def index_info(cur, name=INDEX_NAME):
+    """Return {"method", "opclass", "options", "valid"} for an index, or None if it does not exist"""
+    cur.execute("""
+        SELECT am.amname, opc.opcname, c.reloptions, i.indisvalid
+        FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        JOIN pg_am am ON am.oid = c.relam
+        JOIN pg_opclass opc ON opc.oid = i.indclass[0]
+        WHERE c.relname = %s;
+    """, (name,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    options = dict(opt.split("=", 1) for opt in (row[2] or []))
+    return {"method": row[0], "opclass": row[1], "options": options, "valid": row[3]}
+
+def index_options(index_type, row_count):
+    """WITH (...) options for a new index of the given type"""
+    if index_type == "hnsw":
+        return {"m": str(HNSW_M), "ef_construction": str(HNSW_EF_CONSTRUCTION)}
+    if index_type == "ivfflat":
+        return {"lists": str(ivfflat_lists(row_count))}
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+def needs_rebuild(info, index_type, row_count):
+    """Why the existing index should be rebuilt, or None if it is fine"""
+    if info is None:
+        return "index does not exist"
+    if not info["valid"]:
+        return "index is invalid"
+    if info["method"] != index_type:
+        return f"index type is {info['method']}, configured {index_type}"
+    if info["opclass"] != VECTOR_OPCLASS:
+        return f"operator class is {info['opclass']}, VECTOR_METRIC={VECTOR_METRIC} needs {VECTOR_OPCLASS}"
+
+    wanted = index_options(index_type, row_count)
+    if index_type == "hnsw":
+        # HNSW maintains its graph on insert, so only parameter changes matter
+        current = {key: info["options"].get(key) for key in wanted}
+        if current != wanted:
+            return f"parameters {current} differ from {wanted}"
+        return None
+
+    built_lists = int(info["options"].get("lists", "100"))
+    ideal_lists = int(wanted["lists"])
+    ratio = max(built_lists, ideal_lists) / min(built_lists, ideal_lists)
+    if ratio >= IVFFLAT_REBUILD_FACTOR:
+        return f"lists={built_lists} but {row_count} rows call for lists={ideal_lists}"
+    return None
+
+def build_index(conn, index_type=VECTOR_INDEX_TYPE, name=INDEX_NAME, where=None):
+    """(Re)build one embedding index without blocking queries
+
+    The new index is built concurrently under a temporary name and swapped
+    in, so searches keep using the old one until the build finishes.
+    """
+    previous_autocommit = conn.autocommit
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY cannot run in a transaction
+    cur = conn.cursor()
+    try:
+        row_count = count_embedded(cur, where)
+        options = index_options(index_type, row_count)
+        with_clause = ", ".join(f"{key} = {value}" for key, value in options.items())
+        where_clause = f" WHERE {where}" if where else ""
+        temp_name = f"{name}_new"
+
+        print(f"Building {index_type} index {name} on {row_count} vectors ({with_clause})...")
+        cur.execute(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_WORK_MEM}';")
+        # Leftover from an interrupted build
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {temp_name};")
+        cur.execute(f"""
+            CREATE INDEX CONCURRENTLY {temp_name}
+            ON doc_chunks USING {index_type} (embedding {VECTOR_OPCLASS})
+            WITH ({with_clause}){where_clause};
+        """)
+
+        # Swap the new index in
+        conn.autocommit = False
+        cur.execute(f"DROP INDEX IF EXISTS {name};")
+        cur.execute(f"ALTER INDEX {temp_name} RENAME TO {name};")
+        conn.commit()
+        conn.autocommit = True
+
+        cur.execute("ANALYZE doc_chunks;")
+        print(f"Embedding index {name} built!")
+    except Exception:
+        if not conn.autocommit:
+            conn.rollback()
+        raise
+    finally:
+        cur.close()
+        conn.autocommit = previous_autocommit
+
+def ensure_index(conn, index_type=VECTOR_INDEX_TYPE, force=False):
+    """Create or rebuild the embedding indexes that are missing or stale
+
+    Call after bulk loads. IVFFlat is only built once there are vectors to
+    cluster, since lists trained on an empty table never improve.
+    Returns the names of the rebuilt indexes.
+    """
+    rebuilt = []
+    for name, where in VECTOR_INDEXES.items():
+        cur = conn.cursor()
+        try:
+            row_count = count_embedded(cur, where)
+            info = index_info(cur, name)
+        finally:
+            cur.close()
+        conn.commit()
+
+        if index_type == "ivfflat" and row_count == 0:
+            print(f"No embeddings yet for {name}, IVFFlat index will be built after loading")
+            continue
+
+        reason = "forced rebuild" if force else needs_rebuild(info, index_type, row_count)
+        if reason is None:
+            print(f"Embedding index {name} is up to date ({info['method']}, {info['options']})")
+            continue
+
+        print(f"Rebuilding embedding index {name}: {reason}")
+        build_index(conn, index_type, name, where)
+        rebuilt.append(name)
+    return rebuilt
+
+def show_status(conn):
+    for name, where in VECTOR_INDEXES.items():
+        cur = conn.cursor()
+        try:
+            row_count = count_embedded(cur, where)
+            info = index_info(cur, name)
+        finally:
+            cur.close()
+        conn.commit()
+
+        print(f"Index {name} ({where or 'all chunks'}): {row_count} embedded chunks")
+        if info is None:
+            print("  - Current: missing")
+        else:
+            print(f"  - Current: {info['method']} {info['opclass']} {info['options']} (valid: {info['valid']})")
+        reason = needs_rebuild(info, VECTOR_INDEX_TYPE, row_count)
+        print(f"  - Configured: {VECTOR_INDEX_TYPE} {VECTOR_OPCLASS} {index_options(VECTOR_INDEX_TYPE, row_count)}")
+        print(f"  - Rebuild needed: {reason or 'no'}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the doc_chunks embedding indexes")
+    parser.add_argument("--type", choices=["hnsw", "ivfflat"], default=VECTOR_INDEX_TYPE,
+                        help="Index type to build (default: VECTOR_INDEX_TYPE)")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Rebuild even if the current index looks up to date")
+    parser.add_argument("--status", action="store_true",
+                        help="Only report the current indexes and whether they need a rebuild")
+    args = parser.parse_args()
+
+    conn = get_db_connection()
+    try:
+        if args.status:
+            show_status(conn)
+        else:
+            ensure_index(conn, args.type, force=args.rebuild)
+    finally:
+        conn.close()
@@ -1,6 +1,7 @@
 import psycopg2
 import os
 from dotenv import load_dotenv
+from manage_index import ensure_index
 
 # Load environment variables
 load_dotenv()
@@ -36,6 +37,7 @@ def setup_database():
                 id           SERIAL PRIMARY KEY,
                 source_name  TEXT NOT NULL UNIQUE,
                 raw_text     TEXT NOT NULL,
+                content_hash TEXT,
                 uploaded_at  TIMESTAMP DEFAULT NOW()
             );
         """)
@@ -48,30 +50,89 @@ def setup_database():
                 doc_id       INT REFERENCES documents(id) ON DELETE CASCADE,
                 chunk_index  INT NOT NULL,
                 chunk_text   TEXT NOT NULL,
+                text_hash    TEXT,
+                chunk_type   TEXT,
+                chunk_tsv    TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', chunk_text)) STORED,
                 embedding    VECTOR(768),
+                embedded_at  TIMESTAMP,
                 created_at   TIMESTAMP DEFAULT NOW()
             );
         """)
         print("Doc_chunks table created/verified!")
-       
-        # Create index for fast nearest-neighbor search
-        # Note: This index will be built after embeddings are computed
+        
+        # Content hashes for deduplication and incremental re-ingestion
+        # (added separately so existing databases are upgraded in place)
+        cur.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;")
+        cur.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS text_hash TEXT;")
         cur.execute("""
-            CREATE INDEX IF NOT EXISTS idx_chunks_embedding
-            ON doc_chunks USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);
+            UPDATE doc_chunks
+            SET text_hash = encode(sha256(convert_to(chunk_text, 'UTF8')), 'hex')
+            WHERE text_hash IS NULL;
         """)
-        print("Embedding index created/verified!")
+        print("Content hash columns created/verified!")
+        
+        # Chunk type for table-aware retrieval, computed once instead of per query
+        cur.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS chunk_type TEXT;")
+        cur.execute("""
+            UPDATE doc_chunks
+            SET chunk_type = CASE
+                WHEN chunk_text LIKE '%TABLE DATA:%' THEN 'table'
+                WHEN chunk_text LIKE '%|%' AND
+                     (chunk_text LIKE '%---|%' OR
+                      LENGTH(chunk_text) - LENGTH(REPLACE(chunk_text, '|', '')) > 10)
+                THEN 'table_part'
+                ELSE 'text'
+            END
+            WHERE chunk_type IS NULL;
+        """)
+        print("Chunk type column created/verified!")
         
+        # Full-text search vector for hybrid retrieval, maintained by Postgres on every insert/update
+        cur.execute("""
+            ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS chunk_tsv TSVECTOR
+            GENERATED ALWAYS AS (to_tsvector('simple', chunk_text)) STORED;
+        """)
+        print("Full-text search column created/verified!")
+        
+        # When each embedding was written, so in-memory indexes can sync incrementally
+        cur.execute("ALTER TABLE doc_chunks ADD COLUMN IF NOT EXISTS embedded_at TIMESTAMP;")
+        cur.execute("""
+            UPDATE doc_chunks SET embedded_at = created_at
+            WHERE embedding IS NOT NULL AND embedded_at IS NULL;
+        """)
+        print("Embedding timestamp column created/verified!")
+       
         # Create additional helpful indexes
         cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_chunks_doc_id ON doc_chunks(doc_id);
         """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chunks_doc_index ON doc_chunks(doc_id, chunk_index);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chunks_type ON doc_chunks(chunk_type);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chunks_tsv ON doc_chunks USING gin (chunk_tsv);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_chunks_embedded_at ON doc_chunks(embedded_at);
+        """)
         cur.execute("""
             CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source_name);
         """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash);
+        """)
         print("Additional indexes created/verified!")
        
         conn.commit()
+        
+        # Create index for fast nearest-neighbor search
+        # HNSW is built right away; IVFFlat waits until there are embeddings
+        ensure_index(conn)
+        print("Embedding index created/verified!")
+        
         print("Database schema created successfully!")
        
     except Exception as e:
@@ -0,0 +1,57 @@
+import struct
+import sys
+import unittest
+import numpy as np
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+from embed_chunks import encode_copy_binary
+
+class EncodeCopyBinaryTest(unittest.TestCase):
+    """Decodes the stream by hand, following the PostgreSQL binary COPY and pgvector layouts"""
+
+    def decode(self, data):
+        self.assertEqual(data[:11], b"PGCOPY\n\xff\r\n\x00")
+        flags, extension = struct.unpack_from(">ii", data, 11)
+        self.assertEqual((flags, extension), (0, 0))
+        offset = 19
+        rows = []
+        while True:
+            (field_count,) = struct.unpack_from(">h", data, offset)
+            offset += 2
+            if field_count == -1:
+                break
+            self.assertEqual(field_count, 2)
+            id_len, chunk_id = struct.unpack_from(">ii", data, offset)
+            self.assertEqual(id_len, 4)
+            offset += 8
+            vec_len, dim, unused = struct.unpack_from(">ihh", data, offset)
+            self.assertEqual(vec_len, 4 + 4 * dim)
+            self.assertEqual(unused, 0)
+            offset += 8
+            values = struct.unpack_from(f">{dim}f", data, offset)
+            offset += 4 * dim
+            rows.append((chunk_id, values))
+        self.assertEqual(offset, len(data), "bytes after the trailer")
+        return rows
+
+    def test_rows_round_trip(self):
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(3, 5)).astype(np.float32)
+        rows = self.decode(encode_copy_binary([7, 42, 2**31 - 1], embeddings).getvalue())
+        self.assertEqual([chunk_id for chunk_id, _ in rows], [7, 42, 2**31 - 1])
+        for (_, values), expected in zip(rows, embeddings):
+            np.testing.assert_array_equal(np.array(values, dtype=np.float32), expected)
+
+    def test_float64_input_is_written_as_float4(self):
+        embeddings = np.array([[0.5, -1.25, 3.0]], dtype=np.float64)
+        data = encode_copy_binary([1], embeddings).getvalue()
+        self.assertEqual(len(data), 19 + 2 + 8 + 8 + 3 * 4 + 2)
+        self.assertEqual(self.decode(data), [(1, (0.5, -1.25, 3.0))])
+
+    def test_empty_batch(self):
+        data = encode_copy_binary([], np.empty((0, 4), dtype=np.float32)).getvalue()
+        self.assertEqual(self.decode(data), [])
+
+if __name__ == "__main__":
+    unittest.main()
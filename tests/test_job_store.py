@@ -0,0 +1,97 @@
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "api"))
+from job_store import JobStore
+
+class JobStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = JobStore(str(Path(self.tmp.name) / "jobs.sqlite3"), max_attempts=2, retry_backoff_s=60)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def enqueue(self, task_id, priority=0):
+        self.store.enqueue(task_id, f"{task_id}.pdf", f"/uploads/{task_id}.pdf", priority=priority)
+
+    def test_claim_takes_higher_priority_then_older_jobs(self):
+        self.enqueue("old")
+        self.enqueue("urgent", priority=5)
+        self.enqueue("new")
+        self.assertEqual([self.store.claim()["task_id"] for _ in range(3)], ["urgent", "old", "new"])
+        self.assertIsNone(self.store.claim())
+
+    def test_claim_marks_job_processing_and_counts_attempt(self):
+        self.enqueue("job")
+        job = self.store.claim()
+        self.assertEqual(job["attempts"], 1)
+        stored = self.store.get("job")
+        self.assertEqual(stored["status"], "processing")
+        self.assertEqual(stored["attempts"], 1)
+
+    def test_fail_retries_with_backoff_then_fails(self):
+        self.enqueue("job")
+        job = self.store.claim()
+        before = time.time()
+        self.assertTrue(self.store.fail(job, "boom"))
+        stored = self.store.get("job")
+        self.assertEqual(stored["status"], "retrying")
+        self.assertGreaterEqual(stored["next_run_at"], before + 60)
+        # Not runnable until the backoff has passed
+        self.assertIsNone(self.store.claim())
+        
+        self.store.update("job", next_run_at=time.time())
+        job = self.store.claim()
+        self.assertEqual(job["attempts"], 2)
+        self.assertFalse(self.store.fail(job, "boom again"))
+        stored = self.store.get("job")
+        self.assertEqual(stored["status"], "failed")
+        self.assertIn("boom again", stored["message"])
+        self.assertIsNone(self.store.claim())
+
+    def test_backoff_doubles_per_attempt(self):
+        store = JobStore(self.store.path, max_attempts=3, retry_backoff_s=10)
+        store.enqueue("job", "job.pdf", "/uploads/job.pdf")
+        delays = []
+        for _ in range(2):
+            job = store.claim()
+            before = time.time()
+            store.fail(job, "boom")
+            delays.append(store.get("job")["next_run_at"] - before)
+            store.update("job", next_run_at=time.time())
+        self.assertAlmostEqual(delays[0], 10, delta=1)
+        self.assertAlmostEqual(delays[1], 20, delta=1)
+
+    def test_recover_requeues_interrupted_jobs(self):
+        self.enqueue("job")
+        self.store.claim()
+        recovered, exhausted = self.store.recover()
+        self.assertEqual((recovered, exhausted), (1, []))
+        self.assertEqual(self.store.get("job")["status"], "queued")
+        self.assertEqual(self.store.claim()["attempts"], 2)
+
+    def test_recover_fails_jobs_out_of_attempts(self):
+        self.enqueue("job")
+        job = self.store.claim()
+        self.store.fail(job, "boom")
+        self.store.update("job", next_run_at=time.time())
+        self.store.claim()  # last attempt, interrupted by a restart
+        recovered, exhausted = self.store.recover()
+        self.assertEqual((recovered, exhausted), (0, ["/uploads/job.pdf"]))
+        self.assertEqual(self.store.get("job")["status"], "failed")
+        self.assertIsNone(self.store.claim())
+
+    def test_recover_leaves_other_jobs_alone(self):
+        self.enqueue("queued")
+        self.enqueue("done")
+        self.store.complete("done", "ok")
+        self.assertEqual(self.store.recover(), (0, []))
+        self.assertEqual(self.store.get("queued")["status"], "queued")
+        self.assertEqual(self.store.get("done")["status"], "completed")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+import datetime
+import sys
+import tempfile
+import unittest
+import numpy as np
+from contextlib import contextmanager
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "api"))
+from vector_index import MemoryVectorIndex
+
+DIM = 8
+TYPE_CODES = {"table": 0, "table_part": 1, "text": 2}
+
+class FakeDatabase:
+    """doc_chunks rows answering the queries MemoryVectorIndex.sync runs"""
+
+    def __init__(self):
+        self.rows = {}  # chunk_id -> (embedding, chunk_type, embedded_at)
+
+    def put(self, chunk_id, vector, chunk_type="text"):
+        self.rows[chunk_id] = (list(map(float, vector)), chunk_type, datetime.datetime.now())
+
+    @contextmanager
+    def connect(self):
+        yield FakeConnection(self)
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, name=None):
+        return FakeCursor(self.db)
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        rows = [(chunk_id, *row) for chunk_id, row in self.db.rows.items()]
+        if "COUNT(*)" in sql:
+            self.result = [(len(rows),)]
+        elif "SELECT chunk_id FROM" in sql:
+            self.result = [(row[0],) for row in rows]
+        elif "SELECT chunk_id, embedding" in sql:
+            if params:
+                since = datetime.datetime.min
+                if params[0] is not None:
+                    since = datetime.datetime.fromisoformat(params[0]) - datetime.timedelta(seconds=params[1])
+                rows = [row for row in rows if row[3] is not None and row[3] > since]
+            self.result = rows
+        else:
+            self.result = []
+
+    def fetchmany(self, size):
+        rows, self.result = self.result[:size], self.result[size:]
+        return rows
+
+    def fetchall(self):
+        rows, self.result = self.result, []
+        return rows
+
+    def fetchone(self):
+        return self.result.pop(0)
+
+def unit(rng):
+    vector = rng.normal(size=DIM)
+    return vector / np.linalg.norm(vector)
+
+class MemoryVectorIndexTest(unittest.TestCase):
+    dtype = "float32"
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / "chunks"
+        self.rng = np.random.default_rng(0)
+        self.db = FakeDatabase()
+        self.vectors = {}
+        for chunk_id in range(20):
+            self.add(chunk_id, "table" if chunk_id % 4 == 0 else "text")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def add(self, chunk_id, chunk_type="text"):
+        self.vectors[chunk_id] = unit(self.rng)
+        self.db.put(chunk_id, self.vectors[chunk_id], chunk_type)
+
+    def make_index(self, **options):
+        settings = {"dtype": self.dtype, "dim": DIM, "type_codes": TYPE_CODES, "fetch_rows": 7,
+                    "block_rows": 6, "snapshot_rows": 100}
+        settings.update(options)
+        return MemoryVectorIndex(self.path, **settings)
+
+    def test_search_returns_nearest_rows_best_first(self):
+        index = self.make_index()
+        self.assertEqual(index.sync(self.db.connect), (20, 0))
+        for chunk_id in (3, 8, 17):
+            self.assertEqual(index.search(self.vectors[chunk_id], 1), [chunk_id])
+        query = self.vectors[5]
+        expected = sorted(self.vectors, key=lambda chunk_id: -self.vectors[chunk_id] @ query)[:5]
+        found = index.search(query, 5)
+        self.assertEqual(found[0], 5)
+        if self.dtype == "float32":
+            self.assertEqual(found, expected)
+        else:
+            self.assertEqual(set(found) & set(expected[:2]), set(expected[:2]))
+
+    def test_search_filters_by_type(self):
+        index = self.make_index()
+        index.sync(self.db.connect)
+        found = index.search(self.vectors[5], 3, TYPE_CODES["table"])
+        self.assertEqual(len(found), 3)
+        self.assertTrue(all(chunk_id % 4 == 0 for chunk_id in found))
+
+    def test_sync_adds_new_and_updated_rows(self):
+        index = self.make_index()
+        index.sync(self.db.connect)
+        self.add(20)
+        self.add(3)  # re-embedded
+        self.assertEqual(index.sync(self.db.connect), (2, 0))
+        self.assertEqual(index.search(self.vectors[20], 1), [20])
+        self.assertEqual(index.search(self.vectors[3], 1), [3])
+        self.assertEqual(index.stats()["delta_rows"], 2)
+        # Rows re-read by the lookback are not added again
+        self.assertEqual(index.sync(self.db.connect), (0, 0))
+
+    def test_sync_hides_deleted_chunks(self):
+        index = self.make_index()
+        index.sync(self.db.connect)
+        self.add(20)
+        index.sync(self.db.connect)
+        del self.db.rows[7]
+        del self.db.rows[20]
+        self.assertEqual(index.sync(self.db.connect), (0, 2))
+        self.assertNotIn(7, index.search(self.vectors[7], 20))
+        self.assertNotIn(20, index.search(self.vectors[20], 20))
+        self.assertEqual(len(index.search(self.vectors[0], 30)), 19)
+
+    def test_empty_database_writes_no_snapshots(self):
+        self.db.rows.clear()
+        index = self.make_index()
+        for _ in range(3):
+            self.assertEqual(index.sync(self.db.connect), (0, 0))
+        self.assertTrue(index.ready)
+        self.assertEqual(list(self.path.glob("snapshot-*")), [])
+
+        self.add(20)
+        self.assertEqual(index.sync(self.db.connect), (1, 0))
+        self.assertEqual(index.search(self.vectors[20], 1), [20])
+        self.assertEqual(len(list(self.path.glob("snapshot-*"))), 1)
+        index.sync(self.db.connect)
+        self.assertEqual(len(list(self.path.glob("snapshot-*"))), 1)
+
+    def test_snapshot_round_trip(self):
+        index = self.make_index(snapshot_rows=3)
+        index.sync(self.db.connect)
+        for chunk_id in (20, 21, 22):
+            self.add(chunk_id)
+        del self.db.rows[2]
+        index.sync(self.db.connect)  # compacts into a second snapshot
+        self.assertEqual(index.stats()["delta_rows"], 0)
+
+        loaded = self.make_index()
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.snapshot, index.snapshot)
+        self.assertEqual(loaded.watermark, index.watermark)
+        self.assertEqual(loaded.stats()["snapshot_rows"], 22)
+        for chunk_id in (0, 21):
+            self.assertEqual(loaded.search(self.vectors[chunk_id], 1), [chunk_id])
+        self.assertNotIn(2, loaded.search(self.vectors[2], 30))
+        self.assertEqual([entry.name for entry in self.path.glob("snapshot-*")], [index.snapshot])
+
+    def test_load_rebuilds_mismatched_snapshot(self):
+        index = self.make_index()
+        index.sync(self.db.connect)
+        np.save(self.path / index.snapshot / "ids.npy", np.arange(5, dtype=np.int64))
+
+        rebuilt = self.make_index()
+        self.assertFalse(rebuilt.load())
+        self.assertEqual(rebuilt.sync(self.db.connect), (20, 0))
+        self.assertNotEqual(rebuilt.snapshot, index.snapshot)
+        self.assertTrue(self.make_index().load())
+
+    def test_load_ignores_unfinished_snapshot(self):
+        index = self.make_index()
+        index.sync(self.db.connect)
+        # A save interrupted before current.json was switched
+        (self.path / "snapshot-000099").mkdir()
+        loaded = self.make_index()
+        self.assertTrue(loaded.load())
+        self.assertEqual(loaded.snapshot, index.snapshot)
+
+    def test_load_rejects_other_dtype(self):
+        self.make_index().sync(self.db.connect)
+        other = "int8" if self.dtype == "float32" else "float32"
+        self.assertFalse(self.make_index(dtype=other).load())
+
+class Int8MemoryVectorIndexTest(MemoryVectorIndexTest):
+    dtype = "int8"
+
+if __name__ == "__main__":
+    unittest.main()